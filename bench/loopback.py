@@ -0,0 +1,167 @@
+import argparse
+import contextlib
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'server'))
+sys.path.append(os.path.join(ROOT, 'common'))
+sys.path.append(os.path.join(ROOT, 'client'))
+
+import micro
+import tracing
+from main import AdaptiveChunker, TaskOrchestrator
+from socket_client import SocketClient
+
+CONNECT_TIMEOUT = 30  # seconds to wait for every worker to finish its handshake
+TRACE_GRACE = 0.5  # seconds for the workers' last TRACE messages to arrive before exporting
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+def _percentiles(samples: list[float]) -> dict:
+    if not samples: return {"count": 0}
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples) * 1000, 3),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+        "max_ms": round(samples[-1] * 1000, 3),
+    }
+
+def _start_orchestrator(trace_capacity: int = 0) -> tuple[TaskOrchestrator, int]:
+    orchestrator = TaskOrchestrator(trace_capacity=trace_capacity)
+    orchestrator.server.host = '127.0.0.1'
+    orchestrator.server.port = random.randint(20000, 60000)
+    orchestrator.start()
+    return orchestrator, orchestrator.server.port
+
+def _spawn_workers(port: int, count: int, cores: int, trace: bool = False) -> list[subprocess.Popen]:
+    return [
+        subprocess.Popen(
+            [sys.executable, 'main.py', '127.0.0.1', str(port), str(cores)] + (['--trace'] if trace else []),
+            cwd=os.path.join(ROOT, 'client'),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,  # the worker's pool processes share its group, so one killpg stops them all
+        )
+        for _ in range(count)
+    ]
+
+def _stop_workers(workers: list[subprocess.Popen]):
+    for worker in workers:
+        with contextlib.suppress(ProcessLookupError):
+            os.killpg(worker.pid, signal.SIGKILL)
+        worker.wait()
+
+def bench_handshakes(count: int) -> dict:
+    orchestrator, port = _start_orchestrator()
+    samples = []
+    for _ in range(count):
+        client = SocketClient('127.0.0.1', port)
+        start = time.perf_counter()
+        client.connect()
+        client.handshake(1)
+        samples.append(time.perf_counter() - start)
+        client.sock.close()
+    orchestrator.server.stop()
+    return _percentiles(samples)
+
+def bench_job(action: str, keyspace: int, workers: int, cores: int, chunk_seconds: float, trace: str = None) -> dict:
+    orchestrator, port = _start_orchestrator(tracing.TRACE_CAPACITY if trace else 0)
+    processes = _spawn_workers(port, workers, cores, trace is not None)
+    try:
+        deadline = time.monotonic() + CONNECT_TIMEOUT
+        while len(orchestrator.credits) < workers:
+            if time.monotonic() > deadline: raise Exception(f"Only {len(orchestrator.credits)}/{workers} workers connected")
+            time.sleep(0.01)
+
+        # Times the send path of every TASK (selection is already done, this is encode + encrypt + write)
+        dispatch = []
+        send_task = orchestrator._TaskOrchestrator__send_task
+        def timed_send(connection, task):
+            start = time.perf_counter()
+            send_task(connection, task)
+            dispatch.append(time.perf_counter() - start)
+        orchestrator._TaskOrchestrator__send_task = timed_send
+
+        miss = micro._digests(action, 1)
+        orchestrator.add_source(AdaptiveChunker(range(keyspace), action, miss, target_seconds=chunk_seconds))
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        orchestrator.handle_tasks()
+        elapsed = time.perf_counter() - start
+        cpu = time.process_time() - cpu_start
+        if trace:
+            time.sleep(TRACE_GRACE)
+            orchestrator.export_trace(trace)
+    finally:
+        _stop_workers(processes)
+        orchestrator.server.stop()
+
+    tasks = orchestrator.finished_tasks
+    latency = orchestrator.metrics.task_latency
+    return {
+        "action": action,
+        "workers": workers,
+        "cores_per_worker": cores,
+        "keyspace": keyspace,
+        "tasks": tasks,
+        "seconds": round(elapsed, 4),
+        "hashes_per_second": round(orchestrator.metrics.total_hashes / elapsed),
+        "dispatch": _percentiles(dispatch),
+        "task_latency_mean_ms": round(latency.sum / latency.count * 1000, 3) if latency.count else None,
+        "server_cpu_seconds": round(cpu, 4),
+        "server_cpu_per_task_ms": round(cpu / tasks * 1000, 3) if tasks else None,
+    }
+
+def bench_scaling(action: str, keyspace: int, max_workers: int, cores: int, chunk_seconds: float) -> list[dict]:
+    runs = []
+    for workers in range(1, max_workers + 1):
+        log(f"{action}: {workers} worker(s)")
+        run = bench_job(action, keyspace, workers, cores, chunk_seconds)
+        run["efficiency"] = round(run["hashes_per_second"] / (workers * runs[0]["hashes_per_second"]), 3) if runs else 1.0
+        runs.append(run)
+    return runs
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="End-to-end orchestrator benchmark over loopback")
+    parser.add_argument("--actions", default="MD5,SHA256")
+    parser.add_argument("--keyspace", type=int, default=2_000_000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--cores", type=int, default=1, help="pool processes per worker")
+    parser.add_argument("--chunk-seconds", type=float, default=0.5)
+    parser.add_argument("--handshakes", type=int, default=20)
+    parser.add_argument("--no-micro", action="store_true")
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--trace", help="also run one traced job on every worker and write its Chrome trace here")
+    args = parser.parse_args()
+
+    results = {
+        "config": vars(args),
+        "python": sys.version.split()[0],
+        "cpu_count": os.cpu_count(),
+    }
+    # The orchestrator and client log every task; keep the report readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        log("Handshakes")
+        results["handshake"] = bench_handshakes(args.handshakes)
+        results["scaling"] = {action: bench_scaling(action, args.keyspace, args.workers, args.cores, args.chunk_seconds) for action in args.actions.split(",")}
+        if args.trace:
+            # Separate from the scaling runs so their numbers stay untraced
+            log(f"Traced run -> {args.trace}")
+            results["traced"] = bench_job(args.actions.split(",")[0], args.keyspace, args.workers, args.cores, args.chunk_seconds, args.trace)
+        if not args.no_micro:
+            log("Micro-benchmarks")
+            results["micro"] = micro.run()
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
@@ -0,0 +1,131 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'server'))
+sys.path.append(os.path.join(ROOT, 'common'))
+sys.path.append(os.path.join(ROOT, 'client'))
+
+import codec
+from Crypto.Cipher import AES
+from cipher import CLIENT_TO_SERVER, SERVER_TO_CLIENT, SessionCipher
+from mask import Mask
+from socket_server import Connection
+from task import SET_TARGET_LIMIT, Task, TaskHandler
+
+MISS = "bench-miss"  # never inside a numeric keyspace, so every candidate gets hashed
+
+def _digests(action: str, count: int) -> list[str]:
+    hash_func = hashlib.md5 if action == "MD5" else hashlib.sha256
+    return [hash_func(f"{MISS}-{i}".encode()).hexdigest() for i in range(count)]
+
+def _ns_per_op(func: callable, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return (time.perf_counter() - start) / iterations * 1e9
+
+def bench_kernel(action: str, size: int, target_count: int = 1, mask: str = None) -> dict:
+    task = Task(action, 1, _digests(action, target_count), [(Mask.parse(mask), 0, size) if mask else (0, size)])
+    statuses = []
+    start = time.perf_counter()
+    TaskHandler.cpu_compute_task(0, task, lambda task_id, status, values: statuses.append(status))
+    elapsed = time.perf_counter() - start
+    return {
+        "action": action,
+        "targets": target_count,
+        "mask": mask,
+        "items": size,
+        "seconds": round(elapsed, 4),
+        "hashes_per_second": round(size / elapsed),
+        "status": statuses[-1] if statuses else None,
+    }
+
+def bench_codec(iterations: int) -> dict:
+    targets = _digests("MD5", 1)
+    words = [f"password{i}" for i in range(100)]
+    found = [("123456", targets[0])]
+    job_targets = _digests("MD5", 10_000)
+    job_payload = codec.encode_job(1, job_targets)
+    task_payload = codec.encode_task(1, 1, "MD5", [], [(0, 1_000_000)])
+    words_payload = codec.encode_task(1, 1, "MD5", [], words)
+    found_payload = codec.encode_found(1, found)
+    progress_payload = codec.encode_progress(1, 500_000, found)
+
+    cases = {
+        "encode_job_10k": (lambda: codec.encode_job(1, job_targets), job_payload),
+        "decode_job_10k": (lambda: codec.decode_job(job_payload), job_payload),
+        "encode_task_range": (lambda: codec.encode_task(1, 1, "MD5", [], [(0, 1_000_000)]), task_payload),
+        "decode_task_range": (lambda: codec.decode_task(task_payload), task_payload),
+        "encode_task_words": (lambda: codec.encode_task(1, 1, "MD5", [], words), words_payload),
+        "decode_task_words": (lambda: codec.decode_task(words_payload), words_payload),
+        "encode_found": (lambda: codec.encode_found(1, found), found_payload),
+        "decode_found": (lambda: codec.decode_result(found_payload), found_payload),
+        "encode_progress": (lambda: codec.encode_progress(1, 500_000, found), progress_payload),
+        "decode_progress": (lambda: codec.decode_progress(progress_payload), progress_payload),
+    }
+    return {name: {"ns_per_op": round(_ns_per_op(func, iterations)), "bytes": len(payload)} for name, (func, payload) in cases.items()}
+
+def bench_crypto(iterations: int) -> dict:
+    # Full framing (field join + encrypt + length prefix, and authenticated decrypt + split) at the
+    # sizes of the messages on the server's hot path
+    targets = _digests("MD5", 1)
+    messages = {
+        "task": ['TASK', codec.encode_task(1, 1, "MD5", [], [(0, 1_000_000)])],
+        "done": ['DONE', codec.encode_done(1)],
+        "found": ['FOUND', codec.encode_found(1, [("123456", targets[0])])],
+        "progress": ['PROGRESS', codec.encode_progress(1, 500_000, [])],
+        "slice_64k": ['TASK', codec.encode_task(1, 1, "MD5", [], [os.urandom(64 * 1024)])],
+    }
+    key = os.urandom(32)
+    results = {}
+    for name, fields in messages.items():
+        sender = Connection(None, ('127.0.0.1', 0))
+        sender.cipher = SessionCipher(key, SERVER_TO_CLIENT, CLIENT_TO_SERVER)
+        receiver = Connection(None, ('127.0.0.1', 0))
+        receiver.cipher = SessionCipher(key, CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+
+        start = time.perf_counter()
+        frames = [sender._encode_message(fields) for _ in range(iterations)]
+        encode = (time.perf_counter() - start) / iterations * 1e9
+        start = time.perf_counter()
+        for frame in frames:
+            receiver._decode_message(memoryview(frame)[4:], 1)
+        decode = (time.perf_counter() - start) / iterations * 1e9
+
+        # What the old per-message AES-EAX path cost: a fresh cipher object for every call
+        plaintext = b'\0'.join(field if isinstance(field, bytes) else field.encode() for field in fields)
+        eax = _ns_per_op(lambda: AES.new(key, AES.MODE_EAX, nonce=b'0' * 16).encrypt(plaintext), iterations)
+        results[name] = {
+            "bytes": len(frames[0]),
+            "encode_ns": round(encode),
+            "decode_ns": round(decode),
+            "eax_encrypt_ns": round(eax),
+        }
+    return {"backend": sender.cipher.backend, "messages": results}
+
+def run(kernel_size: int = 500_000, codec_iterations: int = 20_000, crypto_iterations: int = 5_000) -> dict:
+    kernel = []
+    for action in ("MD5", "SHA256"):
+        kernel.append(bench_kernel(action, kernel_size))
+    kernel.append(bench_kernel("MD5", kernel_size, SET_TARGET_LIMIT + 1))
+    kernel.append(bench_kernel("MD5", kernel_size, mask="?l?l?l?d?d?d?d"))
+    kernel.append(bench_kernel("MD5", kernel_size, mask="?a?a?a?a?a?a"))
+    return {"kernel": kernel, "codec": bench_codec(codec_iterations), "crypto": bench_crypto(crypto_iterations)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Hashing kernel and message codec micro-benchmarks")
+    parser.add_argument("--kernel-size", type=int, default=500_000)
+    parser.add_argument("--codec-iterations", type=int, default=20_000)
+    parser.add_argument("--crypto-iterations", type=int, default=5_000)
+    parser.add_argument("--output", default="bench_micro.json")
+    args = parser.parse_args()
+
+    results = run(args.kernel_size, args.codec_iterations, args.crypto_iterations)
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(json.dumps(results, indent=2))
@@ -1,42 +1,104 @@
-import pickle
+import argparse
+import mmap
+import os
+import sys
+
+# codec, cipher, mask and tracing are shared with the server
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+
+import codec
+import tracing
 from task import Task, TaskHandler
 from socket_client import SocketClient
 
 class Worker:
-    def __init__(self, host: str, port: int):
+    def __init__(self, host: str, port: int, cores: int = None, wordlists: list[str] = (), reserved_cores: int = 0, trace_capacity: int = 0):
         self.client = SocketClient(host, port)
+        if trace_capacity: tracing.enable("worker", trace_capacity)
+        self.reserved_cores = reserved_cores
+        # The handshake reports the pool size, so reserved cores never count toward this worker's share
+        self.cores = len(TaskHandler.pool_cpus(cores, reserved_cores))
+        self.wordlists: dict[bytes, str] = {}
+        for path in wordlists:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                self.wordlists[codec.file_id(data)] = path
+            print(f"Serving wordlist {path} locally")
         
     def connect(self):
         self.client.connect()
-        self.client.handshake()
+        self.client.handshake(self.cores)
+        if self.wordlists:
+            self.client.send_fields([
+                'FILES',                                        # ID
+                codec.encode_files(list(self.wordlists))        # Ids of wordlists available locally
+            ])
     
     def _expand_task(self, task: Task):
+        if type(task.input_buffer[0]) is tuple and type(task.input_buffer[0][0]) is bytes:
+            # Wordlist offsets are resolved to the local copy; pool processes map it themselves
+            for file_id, _, _ in task.input_buffer:
+                if file_id not in self.wordlists: raise Exception(f"Unknown wordlist {file_id.hex()}")
+            task.input_buffer = [(self.wordlists[file_id], offset, length) for file_id, offset, length in task.input_buffer]
+            return
         if type(task.input_buffer[0]) is not str or "-" not in task.input_buffer[0]: 
             return
         
+        # Keep ranges as (start, end) descriptors; TaskHandler walks them lazily
         new_buff = []
         for item in task.input_buffer:
             start_str, end_str = item.split("-")
-            start, end = int(start_str), int(end_str)
-            new_buff.extend([str(i) for i in range(start, end)])
+            new_buff.append((int(start_str), int(end_str)))
         task.input_buffer = new_buff
 
     def task_finished(self, task_id: int, status: str, values: list[any]):
+        if status == "progress":
+            done, found = values
+            self.client.send_fields([
+                'PROGRESS',                                     # ID
+                codec.encode_progress(task_id, done, found)     # Task ID + items done + values found so far
+            ])
+            return
+
         print(f"Task {task_id} finished with status: {status}, values: {values}")
+        start = tracing.now()
         if status == "found":
             self.client.send_fields([
-                'FOUND',              # ID
-                str(task_id),         # Task ID
-                pickle.dumps(values)  # Values
+                'FOUND',                                # ID
+                codec.encode_found(task_id, values)     # Task ID + (value, digest) pairs
             ])
         elif status == "done":
             self.client.send_fields([
-                'DONE',               # ID
-                str(task_id)          # Task ID
+                'DONE',                                 # ID
+                codec.encode_done(task_id)              # Task ID
             ])
+        elif status == "error":
+            self.client.send_fields([
+                'ERROR',                                        # ID
+                codec.encode_error(task_id, values[0])          # Task ID + what went wrong
+            ])
+        tracing.record("report", start, task_id)
+        self.send_trace()
+
+    def send_trace(self):
+        # Spans so far go to the server with each result, which keeps the local buffer near empty
+        spans = tracing.drain()
+        if not spans: return
+        self.client.send_fields([
+            'TRACE',                                    # ID
+            codec.encode_trace(spans)                   # Spans recorded since the last TRACE
+        ])
 
+    def cancel(self, data: bytes):
+        _, scope, target_id = self.client._parse_fields(data, 2)
+        if scope == b'JOB':
+            print(f"Cancelling job {int(target_id)}")
+            TaskHandler.cancel_job(int(target_id))
+        elif scope == b'TASK':
+            print(f"Cancelling task {int(target_id)}")
+            TaskHandler.cancel_task(int(target_id))
 
     def accept_tasks(self):
+        TaskHandler.start_pool(self.task_finished, core_count=self.cores, reserved_cores=self.reserved_cores)
         while True:
             try:
                 data, fields = self.client.receive_fields(1)
@@ -44,18 +106,46 @@ class Worker:
                     print("Connection closed by server")
                     break
 
-                if fields[0] == b'TASK':
-                    task = pickle.loads(fields[1])
-                    self._expand_task(task)
+                if fields[0] == b'JOB':
+                    job_id, digest_size, digests = codec.decode_job(fields[1])
+                    TaskHandler.add_job(job_id, digest_size, digests)
+                    print(f"Received {len(digests) // max(1, digest_size)} targets for job {job_id}")
+                elif fields[0] == b'TASK':
+                    start = tracing.now()
+                    task_id, job_id, action, found, input_buffer = codec.decode_task(fields[1])
+                    task = Task(action, task_id, None, input_buffer, job_id, found)
+                    tracing.record("decode", start, task_id)
+                    try:
+                        start = tracing.now()
+                        self._expand_task(task)
+                        tracing.record("expand", start, task_id)
+                    except Exception as e:
+                        # One task this worker cannot run (e.g. a wordlist it does not have) goes back to the server
+                        print(f"Error preparing task {task_id}: {e}")
+                        self.task_finished(task_id, "error", [str(e)])
+                        continue
+                    start = tracing.now()
                     TaskHandler.handle_task(task, self.task_finished)
+                    tracing.record("handle_task", start, task_id)
+                elif fields[0] == b'CANCEL':
+                    self.cancel(data)
             except KeyboardInterrupt:
                 print("Worker shutting down.")
                 break
             except Exception as e:
                 print(f"Error receiving task: {e}")
                 break
+        TaskHandler.stop_pool()
 
 if __name__ == "__main__":
-    worker = Worker('10.100.102.174', 8080)
+    parser = argparse.ArgumentParser(description="TaskOrchestrator worker")
+    parser.add_argument("host", nargs="?", default='10.100.102.174')
+    parser.add_argument("port", nargs="?", type=int, default=8080)
+    parser.add_argument("cores", nargs="?", type=int, default=0, help="pool processes, 0 = one per available CPU")
+    parser.add_argument("wordlists", nargs="*", help="wordlists to read locally instead of receiving them")
+    parser.add_argument("--reserve", type=int, default=0, help="CPUs held back for the OS")
+    parser.add_argument("--trace", action="store_true", help="record per-task spans and send them to the server")
+    args = parser.parse_args()
+    worker = Worker(args.host, args.port, args.cores or None, args.wordlists, args.reserve, tracing.TRACE_CAPACITY if args.trace else 0)
     worker.connect()
     worker.accept_tasks()
\ No newline at end of file
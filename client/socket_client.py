@@ -2,13 +2,17 @@ import multiprocessing
 import socket
 import struct
 import sys
+import threading
+import tracing
 from Crypto.PublicKey import ECC
 from Crypto.Protocol.KDF import HKDF
 from Crypto.Hash import SHA256
-from Crypto.Cipher import AES
+from cipher import CLIENT_TO_SERVER, SERVER_TO_CLIENT, SessionCipher
 
 SEPARATOR = b'\0'
 MSG_LEN_SIZE = 4  # bytes
+MAX_FRAME_SIZE = 256 * 1024 * 1024  # bytes; a longer length prefix drops the connection
+MAX_HANDSHAKE_FRAME_SIZE = 4096  # bytes, until the session key exists
 
 def derive_key(point):
     x = int(point.x)
@@ -22,9 +26,9 @@ class SocketClient:
         self.port = port
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.aes_key = None
-
-    def get_aes(self):
-        return AES.new(self.aes_key, AES.MODE_EAX, nonce=b'0000000000000000') if self.aes_key else None
+        self.cipher: SessionCipher = None
+        self.recv_buffer = bytearray(1024)
+        self.send_lock = threading.Lock()  # frames must leave in the order their nonces were assigned
 
     def __encode_field(self, field: any) -> bytes:
         if isinstance(field, str): field = field.encode('utf-8')
@@ -37,14 +41,20 @@ class SocketClient:
         self.sock.connect((self.host, self.port))
         print(f"Connected to server at {self.host}:{self.port}")
 
-    def receive_raw(self, bufsize=1024) -> bytes:
-        data = b''
-        while len(data) < bufsize:
-            packet = self.sock.recv(bufsize - len(data))
-            if not packet:
+    def receive_raw(self, bufsize=1024) -> memoryview:
+        # Reads straight into a reusable buffer; the returned view is only valid until the next receive.
+        # The buffer doubles as bytes arrive instead of being sized from the peer's length prefix up front
+        received = 0
+        while received < bufsize:
+            if received == len(self.recv_buffer):
+                grown = bytearray(min(bufsize, 2 * len(self.recv_buffer)))
+                grown[:received] = self.recv_buffer
+                self.recv_buffer = grown
+            count = self.sock.recv_into(memoryview(self.recv_buffer)[received:bufsize])
+            if not count:
                 return b''
-            data += packet
-        return data
+            received += count
+        return memoryview(self.recv_buffer)[:bufsize]
 
     def send_raw(self, data: bytes):
         self.sock.sendall(data)
@@ -53,6 +63,8 @@ class SocketClient:
         raw_msglen = self.receive_raw(MSG_LEN_SIZE)
         if not raw_msglen: return b''
         msglen = int.from_bytes(raw_msglen, 'big')
+        limit = MAX_FRAME_SIZE if self.cipher else MAX_HANDSHAKE_FRAME_SIZE
+        if msglen > limit: raise Exception(f"Frame of {msglen} bytes exceeds the {limit} byte limit")
         return self.receive_raw(msglen)
     
     def _parse_fields(self, data: bytes, field_count: int = -1) -> list[bytes]:
@@ -61,36 +73,40 @@ class SocketClient:
     def receive_fields(self, field_limit=-1) -> (bytes, list[bytes]):
         data = self.receive_by_size()
         if not data: return b'', []
-        if self.aes_key and data.startswith(b'AES'):
-            fields = data.split(SEPARATOR, 1)
-            if len(fields) != 2 : raise Exception("Invalid AES message format")
-            if fields[0] != b'AES': raise Exception("Invalid AES message format")
-            ciphertext = fields[1]
-            data = self.get_aes().decrypt(ciphertext)
+        if self.cipher:
+            start = tracing.now()
+            data = self.cipher.decrypt(data)
+            tracing.record("decrypt", start)
 
+        data = bytes(data)
         if not data: return b'', []
         return data, self._parse_fields(data, field_limit)
 
     def send_fields(self, fields: list[bytes]):
         data = SEPARATOR.join([self.__encode_field(field) for field in fields])
-        if self.get_aes():
-            ciphertext = self.get_aes().encrypt(data)
-            data = b'AES' + SEPARATOR + ciphertext
-        data = len(data).to_bytes(MSG_LEN_SIZE, 'big') + data
-        self.send_raw(data)
-
-    def handshake(self):
+        with self.send_lock:
+            if self.cipher:
+                start = tracing.now()
+                frame = self.cipher.encrypt(data, MSG_LEN_SIZE)
+                tracing.record("encrypt", start)
+                frame[:MSG_LEN_SIZE] = (len(frame) - MSG_LEN_SIZE).to_bytes(MSG_LEN_SIZE, 'big')
+            else:
+                frame = len(data).to_bytes(MSG_LEN_SIZE, 'big') + data
+            self.send_raw(frame)
+
+    def handshake(self, core_count: int = None):
         _, fields = self.receive_fields(1)
         if fields[0] != b'HELLO': raise Exception("Invalid handshake from server")
         server_pk = ECC.import_key(fields[1])
         sk = ECC.generate(curve="P-256")
         client_pk = sk.public_key().export_key(format="DER")
-        core_count = multiprocessing.cpu_count()
+        core_count = core_count or multiprocessing.cpu_count()
         self.send_fields([b'HELLO', core_count, client_pk])
 
         shared_point = server_pk.pointQ * sk.d
         key = derive_key(shared_point)
         self.aes_key = key
+        self.cipher = SessionCipher(key, CLIENT_TO_SERVER, SERVER_TO_CLIENT)
         print("Shared key:", key.hex())
 
         self.send_fields([b'OK'])
@@ -1,34 +1,468 @@
 import multiprocessing
 import hashlib
+import mmap
+import os
+import queue
+import threading
+import time
+import zlib
 import psutil
+import tracing
+from collections import deque
+from mask import Mask
+
+CANCEL_CHECK_INTERVAL = 4096  # items hashed between cancellation checks
+PROGRESS_INTERVAL = 2.0  # seconds between PROGRESS checkpoints for a running task
+SUFFIX_DIGITS = 3  # range candidates are hashed in blocks of 10 ** SUFFIX_DIGITS sharing one prefix
+BLOCK_SIZE = 10 ** SUFFIX_DIGITS
+SUFFIXES = [str(i).zfill(SUFFIX_DIGITS).encode() for i in range(BLOCK_SIZE)]
+HASH_FUNCS = {
+    "MD5": hashlib.md5,
+    "SHA256": hashlib.sha256,
+}
+LINE_BLOCK = 64 * 1024  # wordlist bytes split into lines at a time
+SET_TARGET_LIMIT = 100_000  # above this many targets, DigestIndex switches to a sorted array + bit prefilter
+PREFILTER_BITS = 27  # 16 MB prefilter bitmap
+
+class DigestIndex:
+    def __init__(self, digests: list[bytes]):
+        unique = set(digests)
+        self.count = len(unique)
+        self.found: set[bytes] = set()
+        self.compact = self.count > SET_TARGET_LIMIT
+        if not self.compact:
+            self.targets = unique
+            return
+
+        # One contiguous sorted blob instead of millions of bytes objects, fronted by a prefix bitmap
+        self.width = len(digests[0])
+        self.blob = b''.join(sorted(unique))
+        self.shift = 32 - PREFILTER_BITS
+        self.bits = bytearray(1 << (PREFILTER_BITS - 3))
+        for digest in digests:
+            k = int.from_bytes(digest[:4], 'big') >> self.shift
+            self.bits[k >> 3] |= 1 << (k & 7)
+
+    @property
+    def remaining(self) -> int:
+        return self.count - len(self.found)
+
+    def __search(self, digest: bytes) -> bool:
+        lo, hi, width = 0, self.count, self.width
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self.blob[mid * width:(mid + 1) * width]
+            if value == digest: return True
+            if value < digest: lo = mid + 1
+            else: hi = mid
+        return False
+
+    @staticmethod
+    def unpack(digests: bytes, digest_size: int) -> "DigestIndex":
+        if not digest_size: return DigestIndex([])
+        return DigestIndex([digests[i:i + digest_size] for i in range(0, len(digests), digest_size)])
+
+    def match(self, digest: bytes) -> bool:
+        if not self.compact: return digest in self.targets
+        k = int.from_bytes(digest[:4], 'big') >> self.shift
+        return bool(self.bits[k >> 3] >> (k & 7) & 1) and digest not in self.found and self.__search(digest)
+
+    def hits(self, digests: list[bytes]) -> set[bytes]:
+        if not self.compact: return self.targets.intersection(digests)
+        return {digest for digest in digests if self.match(digest)}
+
+    def mark_found(self, digest: bytes):
+        self.found.add(digest)
+        if not self.compact: self.targets.discard(digest)
+
+    def unmark(self, digest: bytes):
+        self.found.discard(digest)
+        if not self.compact: self.targets.add(digest)
+
+    def drop(self, digest: bytes):
+        # Found by another task; anything that is not a target still being looked for is ignored
+        if self.match(digest): self.mark_found(digest)
+
+class JobTargets:
+    # A job's target digests as the server sent them, kept until the server cancels the job
+    def __init__(self, digest_size: int, digests: bytes):
+        self.digest_size = digest_size
+        self.digests = digests
+        self.found: list[str] = []  # found elsewhere, in the order the server reported them
 
 class Task:
-    def __init__(self, action: str, id: int, expected_result, input_buffer):
+    def __init__(self, action: str, id: int, expected_result, input_buffer, job_id: int = 0, found: list[str] = ()):
         self.action = action
         self.id = id
-        self.expected_result = expected_result
+        self.expected_result = expected_result  # None for tasks from the server, which searches for its job's targets
         self.input_buffer = input_buffer
+        self.job_id = job_id
+        self.found = found
 
 class TaskHandler:
-    cores_used = 0
-    running_processes = []
+    tasks_per_core = 2
+    processes: list[multiprocessing.Process] = []
+    task_queues: list[multiprocessing.Queue] = []
+    result_queue: multiprocessing.Queue = None
+    in_flight: list[deque] = []
+    cancel_ids: list[multiprocessing.Value] = []  # per core: id of the task to stop; ids are unique, so it never needs clearing
+    cancelled_tasks: set[int] = set()
+    cancelled_jobs: set[int] = set()
+    slots_changed = threading.Condition()
+    callback: callable = None
+    mapped_files: dict[str, mmap.mmap] = {}
+    jobs: dict[int, JobTargets] = {}
+    core_jobs: list[dict[int, int]] = []  # per core: job id -> found digests forwarded, for jobs whose targets that process holds
+
+    @staticmethod
+    def _item_size(item) -> int:
+        # Ranges and masks count items, wordlist slices count bytes
+        if type(item) is bytes: return len(item)
+        if type(item) is tuple and isinstance(item[0], Mask): return item[2] - item[1]
+        if type(item) is tuple: return item[2] if len(item) == 3 else item[1] - item[0]
+        return 1
+
+    @staticmethod
+    def input_size(input_buffer: list) -> int:
+        return sum(TaskHandler._item_size(item) for item in input_buffer)
+
+    @staticmethod
+    def _map_file(path: str) -> mmap.mmap:
+        # Each pool process maps a wordlist once and keeps it for every later task
+        if path not in TaskHandler.mapped_files:
+            with open(path, 'rb') as f:
+                TaskHandler.mapped_files[path] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return TaskHandler.mapped_files[path]
+
+    @staticmethod
+    def _plaintext(line: bytes) -> str:
+        # Lines that are not UTF-8 are reported in hashcat's $HEX[...] form, so the exact bytes survive
+        try:
+            return line.decode('utf-8')
+        except UnicodeDecodeError:
+            return f"$HEX[{line.hex()}]"
+
+    @staticmethod
+    def _hash_lines(hash_func: callable, data, start: int, end: int, index: DigestIndex, found: list, checkpoint: callable, base: int) -> bool:
+        # Lines are split out of bounded blocks of the mapping (never the whole file); checkpoint
+        # offsets are bytes consumed and always fall on a line start
+        pos = start
+        while pos < end and index.remaining:
+            if not checkpoint(base + pos - start): return False
+            block_end = min(end, pos + LINE_BLOCK)
+            if block_end < end:
+                newline = data.rfind(b'\n', pos, block_end)
+                if newline < 0: newline = data.find(b'\n', block_end, end)
+                block_end = newline + 1 if newline >= 0 else end
+            lines = data[pos:block_end].splitlines()
+            digests = [hash_func(line).digest() for line in lines]
+            for digest in index.hits(digests):
+                index.mark_found(digest)
+                found.append((TaskHandler._plaintext(lines[digests.index(digest)]), digest.hex()))
+            pos = block_end
+        return True
+
+    @staticmethod
+    def _hash_range(hash_func: callable, start: int, end: int, index: DigestIndex, found: list, checkpoint: callable, base: int) -> bool:
+        # Ragged edges (and values below BLOCK_SIZE, which have no zero padding) are hashed one by one
+        head_end = min(end, max(BLOCK_SIZE, -(-start // BLOCK_SIZE) * BLOCK_SIZE))
+        for i in range(start, head_end):
+            TaskHandler._check_candidate(hash_func, str(i), index, found)
+
+        i = head_end
+        while i + BLOCK_SIZE <= end and index.remaining:
+            if not checkpoint(base + i - start): return False
+            prefix = str(i // BLOCK_SIZE).encode()
+            digests = [hash_func(prefix + suffix).digest() for suffix in SUFFIXES]
+            for digest in index.hits(digests):
+                index.mark_found(digest)
+                found.append((str(i + digests.index(digest)), digest.hex()))
+            i += BLOCK_SIZE
+        # With every target found the block loop stops early; only a ragged end is left to hash one by one
+        if not index.remaining: return True
+
+        for i in range(i, end):
+            TaskHandler._check_candidate(hash_func, str(i), index, found)
+        return True
+
+    @staticmethod
+    def _hash_mask(hash_func: callable, mask: Mask, start: int, end: int, index: DigestIndex, found: list, checkpoint: callable, base: int) -> bool:
+        # Each block shares one prefix from the mask's odometer and walks a precomputed suffix table
+        done = 0
+        for prefix, suffixes in mask.blocks(start, end):
+            if not index.remaining: break
+            if not checkpoint(base + done): return False
+            digests = [hash_func(prefix + suffix).digest() for suffix in suffixes]
+            for digest in index.hits(digests):
+                index.mark_found(digest)
+                found.append(((prefix + suffixes[digests.index(digest)]).decode('latin-1'), digest.hex()))
+            done += len(suffixes)
+        return True
+
+    @staticmethod
+    def _check_candidate(hash_func: callable, item: str, index: DigestIndex, found: list):
+        digest = hash_func(item.encode()).digest()
+        if index.match(digest):
+            index.mark_found(digest)
+            found.append((item, digest.hex()))
+
+    @staticmethod
+    def cpu_compute_task(core: int, task: Task, callback: callable, cancelled: callable = None, progress: callable = None, index: DigestIndex = None):
+        hash_func = HASH_FUNCS.get(task.action)
+        if hash_func is None: raise Exception(f"Unsupported action {task.action}")
+        if index is None:
+            targets = [task.expected_result] if isinstance(task.expected_result, str) else task.expected_result
+            index = DigestIndex([bytes.fromhex(target) for target in targets])
+        found = []
+        finished = False
+        try:
+            finished = TaskHandler._search(task, hash_func, index, found, cancelled, progress)
+        finally:
+            # A cached index must not keep hits that were never reported, or a retried remainder would skip them
+            if not finished:
+                for _, digest in found: index.unmark(bytes.fromhex(digest))
+        if not finished: callback(task.id, "cancelled", [])
+        elif found: callback(task.id, "found", found)
+        else: callback(task.id, "done", [])
 
     @staticmethod
-    def cpu_compute_task(core: int, task: Task, callback: callable):
-        hash_func = hashlib.md5 if task.action == "MD5" else hashlib.sha256 if task.action == "SHA256" else lambda x: None
+    def _search(task: Task, hash_func: callable, index: DigestIndex, found: list, cancelled: callable, progress: callable) -> bool:
+        # False if the task was cancelled before its whole input was searched
+        next_progress = time.monotonic() + PROGRESS_INTERVAL
+
+        def checkpoint(offset: int) -> bool:
+            # offset = items of this task fully hashed so far; found values travel with it so a
+            # requeued remainder never skips an unreported hit
+            nonlocal next_progress
+            if cancelled and cancelled(): return False
+            if progress and time.monotonic() >= next_progress:
+                progress(task.id, offset, list(found))
+                next_progress = time.monotonic() + PROGRESS_INTERVAL
+            return True
+
+        offset = 0
         for item in task.input_buffer:
-            if hash_func(item.encode()).hexdigest() == task.expected_result:
-                callback(task.id, "found", [item])
-                return
-           
-        callback(task.id, "done", [])
+            if not index.remaining: break
+            if type(item) is tuple and isinstance(item[0], Mask):
+                mask, start, end = item
+                if not TaskHandler._hash_mask(hash_func, mask, start, end, index, found, checkpoint, offset):
+                    return False
+                offset += end - start
+                continue
+            if type(item) is tuple and len(item) == 3:
+                path, start, length = item
+                if not TaskHandler._hash_lines(hash_func, TaskHandler._map_file(path), start, start + length, index, found, checkpoint, offset):
+                    return False
+                offset += length
+                continue
+            if type(item) is bytes:
+                data = zlib.decompress(item)
+                if not TaskHandler._hash_lines(hash_func, data, 0, len(data), index, found, checkpoint, offset):
+                    return False
+                offset += len(data)
+                continue
+            if type(item) is tuple:
+                if not TaskHandler._hash_range(hash_func, item[0], item[1], index, found, checkpoint, offset):
+                    return False
+                offset += item[1] - item[0]
+                continue
+
+            if offset % CANCEL_CHECK_INTERVAL == 0 and not checkpoint(offset):
+                return False
+            TaskHandler._check_candidate(hash_func, item, index, found)
+            offset += 1
+        return True
+
+    @staticmethod
+    def available_cpus() -> list[int]:
+        if hasattr(os, "sched_getaffinity"): return sorted(os.sched_getaffinity(0))
+        try:
+            return sorted(psutil.Process().cpu_affinity())
+        except (AttributeError, psutil.Error):
+            return list(range(multiprocessing.cpu_count()))
+
+    @staticmethod
+    def pool_cpus(core_count: int = None, reserved_cores: int = 0) -> list[int]:
+        # CPU each pool process is pinned to. Reserved cores are the lowest-numbered ones, where the OS
+        # takes most of its interrupts; asking for more processes than CPUs wraps around
+        cpus = TaskHandler.available_cpus()
+        cpus = cpus[min(max(0, reserved_cores), len(cpus) - 1):]
+        return [cpus[i % len(cpus)] for i in range(core_count or len(cpus))]
+
+    @staticmethod
+    def _pin(cpu: int):
+        try:
+            psutil.Process().cpu_affinity([cpu])
+        except AttributeError:
+            # psutil has no affinity support on macOS; neither does os
+            if hasattr(os, "sched_setaffinity"): os.sched_setaffinity(0, {cpu})
+        except (psutil.Error, OSError) as e:
+            print(f"Could not pin pool process to CPU {cpu}: {e}")
+
+    @staticmethod
+    def _pool_worker(
+        core: int,
+        cpu: int,
+        task_queue: multiprocessing.Queue,
+        result_queue: multiprocessing.Queue,
+        cancel_id: multiprocessing.Value,
+        trace: bool = False
+    ):
+        started = 0
+        def report(task_id, status, values):
+            # The hashing span goes ahead of the result, so it reaches the server with the same TRACE
+            if trace: result_queue.put((core, task_id, "span", ("hash", started, time.perf_counter_ns())))
+            result_queue.put((core, task_id, status, values))
+        progress = lambda task_id, offset, values: result_queue.put((core, task_id, "progress", (offset, values)))
+        parent = os.getppid()
+        indexes: dict[int, DigestIndex] = {}  # built once per job, so later tasks skip the build and the targets already found
+        TaskHandler._pin(cpu)
+        while True:
+            try:
+                task = task_queue.get(timeout=1)
+            except queue.Empty:
+                # Exit instead of lingering as an orphan if the worker process was killed
+                if os.getppid() != parent: break
+                continue
+            if task is None: break
+            if type(task) is tuple:
+                # ("targets", job id, digest size, digests) ahead of a job's first task here, ("forget", job id) once it is over
+                indexes.pop(task[1], None)
+                try:
+                    if task[0] == "targets": indexes[task[1]] = DigestIndex.unpack(task[3], task[2])
+                except Exception as e:
+                    # The job's tasks then come back as ERROR instead of this process dying
+                    print(f"Error loading targets of job {task[1]} on core {core}: {e}")
+                continue
+            # The parent may write cancel_id before this process has even taken the task off the queue
+            cancelled = lambda: cancel_id.value == task.id or os.getppid() != parent
+            if trace: started = time.perf_counter_ns()
+            try:
+                index = None
+                if task.expected_result is None:
+                    index = indexes.get(task.job_id)
+                    if index is None: raise Exception(f"No targets for job {task.job_id}")
+                    for digest in task.found: index.drop(bytes.fromhex(digest))
+                TaskHandler.cpu_compute_task(core, task, report, cancelled, progress, index)
+            except Exception as e:
+                print(f"Error computing task {task.id} on core {core}: {e}")
+                report(task.id, "error", [str(e)])
+
+    @staticmethod
+    def _collect_results():
+        while True:
+            result = TaskHandler.result_queue.get()
+            if result is None: break
+            core, task_id, status, values = result
+            if status == "span":
+                name, start, end = values
+                tracing.record(name, start, task_id, end, f"core {core}")
+                continue
+            if status == "progress":
+                TaskHandler.callback(task_id, status, values)
+                continue
+            with TaskHandler.slots_changed:
+                queued = TaskHandler.in_flight[core]
+                for entry in queued:
+                    if entry[0] == task_id:
+                        queued.remove(entry)
+                        break
+                TaskHandler.cancelled_tasks.discard(task_id)
+                if queued: TaskHandler._signal_if_cancelled(core)
+                TaskHandler.slots_changed.notify()
+            TaskHandler.callback(task_id, status, values)
+
+    @staticmethod
+    def _signal_if_cancelled(core: int):
+        # Only the head of a core's queue is running; later entries are signalled once they reach the head
+        task_id, job_id = TaskHandler.in_flight[core][0]
+        if task_id in TaskHandler.cancelled_tasks or job_id in TaskHandler.cancelled_jobs:
+            TaskHandler.cancel_ids[core].value = task_id
+
+    @staticmethod
+    def cancel_task(task_id: int):
+        with TaskHandler.slots_changed:
+            for core, queued in enumerate(TaskHandler.in_flight):
+                if any(entry[0] == task_id for entry in queued):
+                    TaskHandler.cancelled_tasks.add(task_id)
+                    TaskHandler._signal_if_cancelled(core)
+
+    @staticmethod
+    def add_job(job_id: int, digest_size: int, digests: bytes):
+        with TaskHandler.slots_changed:
+            if job_id not in TaskHandler.cancelled_jobs: TaskHandler.jobs[job_id] = JobTargets(digest_size, digests)
+
+    @staticmethod
+    def cancel_job(job_id: int):
+        # The server also sends this once a job is exhausted, so it is where a job's targets are freed
+        with TaskHandler.slots_changed:
+            TaskHandler.cancelled_jobs.add(job_id)
+            TaskHandler.jobs.pop(job_id, None)
+            for core, held in enumerate(TaskHandler.core_jobs):
+                if held.pop(job_id, None) is not None: TaskHandler.task_queues[core].put(("forget", job_id))
+            for core, queued in enumerate(TaskHandler.in_flight):
+                if queued: TaskHandler._signal_if_cancelled(core)
+
+    @staticmethod
+    def start_pool(callback: callable, tasks_per_core: int = None, core_count: int = None, reserved_cores: int = 0):
+        if TaskHandler.processes: return
+        start = tracing.now()
+        cpus = TaskHandler.pool_cpus(core_count, reserved_cores)
+        core_count = len(cpus)
+        TaskHandler.callback = callback
+        if tasks_per_core is not None: TaskHandler.tasks_per_core = max(1, tasks_per_core)
+        TaskHandler.result_queue = multiprocessing.Queue()
+        TaskHandler.task_queues = [multiprocessing.Queue() for _ in range(core_count)]
+        TaskHandler.in_flight = [deque() for _ in range(core_count)]
+        TaskHandler.core_jobs = [{} for _ in range(core_count)]
+        TaskHandler.cancel_ids = [multiprocessing.Value('Q', 0) for _ in range(core_count)]
+        for core in range(core_count):
+            p = multiprocessing.Process(
+                target=TaskHandler._pool_worker,
+                args=(core, cpus[core], TaskHandler.task_queues[core], TaskHandler.result_queue, TaskHandler.cancel_ids[core], tracing.tracer is not None),
+                daemon=True
+            )
+            p.start()
+            TaskHandler.processes.append(p)
+        threading.Thread(target=TaskHandler._collect_results, daemon=True).start()
+        tracing.record("start_pool", start)
+        print(f"Started worker pool with {core_count} processes on CPUs {cpus} ({TaskHandler.tasks_per_core} tasks per core)")
+
+    @staticmethod
+    def stop_pool():
+        for task_queue in TaskHandler.task_queues:
+            task_queue.put(None)
+        for p in TaskHandler.processes:
+            p.join(timeout=1)
+            if p.is_alive(): p.terminate()
+        if TaskHandler.result_queue is not None:
+            TaskHandler.result_queue.put(None)
+        TaskHandler.processes = []
+        TaskHandler.task_queues = []
 
     @staticmethod
     def handle_task(task: Task, callback: callable):
-        core_count = multiprocessing.cpu_count()
-        core_index = TaskHandler.cores_used % core_count
-        TaskHandler.cores_used += 1
-        print(f"Processing task {task.id} with action {task.action} on input of size {len(task.input_buffer)} on core {core_index}")
-        p = multiprocessing.Process(target=TaskHandler.cpu_compute_task, args=(core_index, task, callback))
-        p.start()
-        TaskHandler.running_processes.append(p)
\ No newline at end of file
+        TaskHandler.start_pool(callback)
+        job_id = getattr(task, "job_id", 0)
+        with TaskHandler.slots_changed:
+            if job_id in TaskHandler.cancelled_jobs:
+                print(f"Skipping task {task.id} of cancelled job {job_id}")
+                return
+            # Blocks the receiver when every core already holds tasks_per_core tasks, which backpressures the server
+            while True:
+                core_index = min(range(len(TaskHandler.in_flight)), key=lambda i: len(TaskHandler.in_flight[i]))
+                if len(TaskHandler.in_flight[core_index]) < TaskHandler.tasks_per_core: break
+                TaskHandler.slots_changed.wait()
+            TaskHandler.in_flight[core_index].append((task.id, job_id))
+            job = TaskHandler.jobs.get(job_id) if task.expected_result is None else None
+            if job is not None:
+                # A pool process gets a job's targets ahead of its first task of the job, then only the digests found since
+                held = TaskHandler.core_jobs[core_index]
+                if job_id not in held:
+                    TaskHandler.task_queues[core_index].put(("targets", job_id, job.digest_size, job.digests))
+                    held[job_id] = 0
+                job.found.extend(task.found)
+                task.found = job.found[held[job_id]:]
+                held[job_id] = len(job.found)
+        print(f"Processing task {task.id} with action {task.action} on input of size {TaskHandler.input_size(task.input_buffer)} on core {core_index}")
+        TaskHandler.task_queues[core_index].put(task)
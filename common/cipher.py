@@ -0,0 +1,58 @@
+import struct
+from Crypto.Cipher import AES
+
+try:
+    # Optional: keeps one expanded key per session instead of rebuilding the cipher for every message
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:
+    AESGCM = None
+
+# Session encryption for both ends
+NONCE = struct.Struct('!IQ')  # direction, message counter
+TAG_SIZE = 16
+SERVER_TO_CLIENT = 1
+CLIENT_TO_SERVER = 2
+
+class SessionCipher:
+    def __init__(self, key: bytes, send_direction: int, receive_direction: int):
+        # Nonces are never sent: each side numbers the messages it sends, so a replayed, dropped,
+        # reordered or altered frame fails authentication on the other end
+        self.key = key
+        self.aead = AESGCM(key) if AESGCM else None
+        self.send_direction = send_direction
+        self.receive_direction = receive_direction
+        self.sent = 0
+        self.received = 0
+
+    @property
+    def backend(self) -> str:
+        return "cryptography" if self.aead else "pycryptodome"
+
+    def encrypt(self, plaintext: bytes, header_size: int = 0) -> bytearray:
+        # Returns one frame buffer: header_size free bytes for the caller, then ciphertext and tag
+        nonce = NONCE.pack(self.send_direction, self.sent)
+        self.sent += 1
+        if self.aead:
+            frame = bytearray(header_size)
+            frame += self.aead.encrypt(nonce, plaintext, None)
+            return frame
+
+        frame = bytearray(header_size + len(plaintext) + TAG_SIZE)
+        cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce, mac_len=TAG_SIZE)
+        cipher.encrypt(plaintext, output=memoryview(frame)[header_size:header_size + len(plaintext)])
+        frame[-TAG_SIZE:] = cipher.digest()
+        return frame
+
+    def decrypt(self, frame) -> bytes:
+        if len(frame) < TAG_SIZE: raise Exception("Encrypted message too short")
+        nonce = NONCE.pack(self.receive_direction, self.received)
+        try:
+            if self.aead:
+                plaintext = self.aead.decrypt(nonce, bytes(frame), None)
+            else:
+                cipher = AES.new(self.key, AES.MODE_GCM, nonce=nonce, mac_len=TAG_SIZE)
+                plaintext = cipher.decrypt_and_verify(frame[:-TAG_SIZE], frame[-TAG_SIZE:])
+        except Exception:
+            raise Exception("Message authentication failed")
+        self.received += 1
+        return plaintext
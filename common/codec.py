@@ -0,0 +1,224 @@
+import hashlib
+import struct
+from mask import Mask
+
+# Binary payloads for JOB / TASK / DONE / FOUND / PROGRESS / ERROR / BATCH / FILES / TRACE
+CODEC_VERSION = 4
+
+ACTION_CODES = {"MD5": 1, "SHA256": 2}
+ACTION_NAMES = {code: name for name, code in ACTION_CODES.items()}
+
+INPUT_RANGES = 0
+INPUT_STRINGS = 1
+INPUT_FILE = 2  # (file id, byte offset, length) into a wordlist the worker has locally
+INPUT_SLICE = 3  # zlib-compressed wordlist bytes for workers without the file
+INPUT_MASK = 4  # mask spec once, then index ranges into its keyspace
+
+FILE_ID_SIZE = 16
+FILE_ID_BLOCK = 64 * 1024 * 1024  # bytes hashed per step when fingerprinting a file
+
+JOB_HEADER = struct.Struct('!BQBI')  # version, job id, digest size, target count
+TASK_HEADER = struct.Struct('!BQQBBIBI')  # version, task id, job id, action, input kind, found count, digest size, input count
+RESULT_HEADER = struct.Struct('!BQI')  # version, task id, value count
+PROGRESS_HEADER = struct.Struct('!BQQI')  # version, task id, items done, value count
+ERROR_HEADER = struct.Struct('!BQ')  # version, task id; followed by the error message
+RANGE = struct.Struct('!QQ')
+LENGTH = struct.Struct('!I')
+FILE_SLICE = struct.Struct(f'!{FILE_ID_SIZE}sQQ')  # file id, byte offset, length
+BATCH_HEADER = struct.Struct('!BII')  # version, result count, progress count
+RESULT_ENTRY = struct.Struct('!QI')  # task id, value count
+PROGRESS_ENTRY = struct.Struct('!QQI')  # task id, items done, value count
+FILES_HEADER = struct.Struct('!BI')  # version, file count
+TRACE_HEADER = struct.Struct('!BI')  # version, span count
+SPAN = struct.Struct('!QQQ')  # task id, start ns, end ns; followed by the span name and track
+
+def file_id(data) -> bytes:
+    # Content fingerprint, so a worker's copy only matches the server's if the bytes are identical
+    digest = hashlib.blake2b(digest_size=FILE_ID_SIZE)
+    view = memoryview(data)
+    for offset in range(0, len(view), FILE_ID_BLOCK):
+        digest.update(view[offset:offset + FILE_ID_BLOCK])
+    return digest.digest()
+
+def _check_version(payload) -> None:
+    if not payload or payload[0] != CODEC_VERSION:
+        raise Exception(f"Unsupported codec version {payload[0] if payload else None}")
+
+def _pack_strings(values: list) -> bytes:
+    parts = []
+    for value in values:
+        if isinstance(value, str): value = value.encode('utf-8')
+        parts.append(LENGTH.pack(len(value)))
+        parts.append(value)
+    return b''.join(parts)
+
+def _unpack_bytes(payload, offset: int, count: int) -> tuple[list[bytes], int]:
+    values = []
+    for _ in range(count):
+        (length,) = LENGTH.unpack_from(payload, offset)
+        offset += LENGTH.size
+        values.append(bytes(payload[offset:offset + length]))
+        offset += length
+    return values, offset
+
+def _unpack_strings(payload, offset: int, count: int) -> tuple[list[str], int]:
+    values, offset = _unpack_bytes(payload, offset, count)
+    return [value.decode('utf-8') for value in values], offset
+
+def _pack_digests(digests: list[str]) -> tuple[int, bytes]:
+    packed = [bytes.fromhex(digest) for digest in digests]
+    return (len(packed[0]) if packed else 0), b''.join(packed)
+
+def encode_job(job_id: int, targets: list[str]) -> bytes:
+    # A job's targets go to each worker once, ahead of its first task of the job
+    digest_size, digests = _pack_digests(targets)
+    return JOB_HEADER.pack(CODEC_VERSION, job_id, digest_size, len(targets)) + digests
+
+def decode_job(payload) -> tuple[int, int, bytes]:
+    # The digests stay packed back to back; the worker hands them to its pool processes as they are
+    _check_version(payload)
+    _, job_id, digest_size, count = JOB_HEADER.unpack_from(payload)
+    return job_id, digest_size, bytes(payload[JOB_HEADER.size:JOB_HEADER.size + count * digest_size])
+
+def encode_task(task_id: int, job_id: int, action: str, found: list[str], input_buffer: list) -> bytes:
+    # found = the job's targets found since this worker's last task of the job, so it stops looking for them
+    digest_size, digests = _pack_digests(found)
+    if input_buffer and type(input_buffer[0]) is tuple and isinstance(input_buffer[0][0], Mask):
+        # Every item of a task indexes the same mask
+        kind = INPUT_MASK
+        inputs = _pack_strings([input_buffer[0][0].to_spec()]) + b''.join(RANGE.pack(start, end) for _, start, end in input_buffer)
+    elif input_buffer and type(input_buffer[0]) is tuple and len(input_buffer[0]) == 3:
+        kind = INPUT_FILE
+        inputs = b''.join(FILE_SLICE.pack(*item) for item in input_buffer)
+    elif input_buffer and type(input_buffer[0]) is tuple:
+        kind = INPUT_RANGES
+        inputs = b''.join(RANGE.pack(start, end) for start, end in input_buffer)
+    elif input_buffer and type(input_buffer[0]) is bytes:
+        kind = INPUT_SLICE
+        inputs = _pack_strings(input_buffer)
+    else:
+        kind = INPUT_STRINGS
+        inputs = _pack_strings(input_buffer)
+
+    header = TASK_HEADER.pack(CODEC_VERSION, task_id, job_id, ACTION_CODES[action], kind, len(found), digest_size, len(input_buffer))
+    return b''.join([header, digests, inputs])
+
+def decode_task(payload) -> tuple[int, int, str, list[str], list]:
+    _check_version(payload)
+    _, task_id, job_id, action, kind, found_count, digest_size, input_count = TASK_HEADER.unpack_from(payload)
+    offset = TASK_HEADER.size
+
+    found = [bytes(payload[offset + i * digest_size:offset + (i + 1) * digest_size]).hex() for i in range(found_count)]
+    offset += found_count * digest_size
+
+    if kind == INPUT_RANGES:
+        input_buffer = list(RANGE.iter_unpack(payload[offset:offset + input_count * RANGE.size]))
+    elif kind == INPUT_MASK:
+        (spec,), offset = _unpack_bytes(payload, offset, 1)
+        mask = Mask.from_spec(spec)
+        input_buffer = [(mask, start, end) for start, end in RANGE.iter_unpack(payload[offset:offset + input_count * RANGE.size])]
+    elif kind == INPUT_FILE:
+        input_buffer = list(FILE_SLICE.iter_unpack(payload[offset:offset + input_count * FILE_SLICE.size]))
+    elif kind == INPUT_SLICE:
+        input_buffer, _ = _unpack_bytes(payload, offset, input_count)
+    else:
+        input_buffer, _ = _unpack_strings(payload, offset, input_count)
+    return task_id, job_id, ACTION_NAMES[action], found, input_buffer
+
+def encode_done(task_id: int) -> bytes:
+    return RESULT_HEADER.pack(CODEC_VERSION, task_id, 0)
+
+def encode_found(task_id: int, values: list[tuple[str, str]]) -> bytes:
+    return RESULT_HEADER.pack(CODEC_VERSION, task_id, len(values)) + _pack_values(values)
+
+def _pack_values(values: list[tuple[str, str]]) -> bytes:
+    return _pack_strings([item for value, digest in values for item in (value, bytes.fromhex(digest))])
+
+def _unpack_values(payload, offset: int, count: int) -> tuple[list[tuple[str, str]], int]:
+    values = []
+    for _ in range(count):
+        (length,) = LENGTH.unpack_from(payload, offset)
+        offset += LENGTH.size
+        value = bytes(payload[offset:offset + length]).decode('utf-8')
+        offset += length
+        (length,) = LENGTH.unpack_from(payload, offset)
+        offset += LENGTH.size
+        digest = bytes(payload[offset:offset + length]).hex()
+        offset += length
+        values.append((value, digest))
+    return values, offset
+
+def decode_result(payload) -> tuple[int, list[tuple[str, str]]]:
+    _check_version(payload)
+    _, task_id, count = RESULT_HEADER.unpack_from(payload)
+    return task_id, _unpack_values(payload, RESULT_HEADER.size, count)[0]
+
+def encode_progress(task_id: int, done: int, values: list[tuple[str, str]]) -> bytes:
+    return PROGRESS_HEADER.pack(CODEC_VERSION, task_id, done, len(values)) + _pack_values(values)
+
+def decode_progress(payload) -> tuple[int, int, list[tuple[str, str]]]:
+    _check_version(payload)
+    _, task_id, done, count = PROGRESS_HEADER.unpack_from(payload)
+    return task_id, done, _unpack_values(payload, PROGRESS_HEADER.size, count)[0]
+
+def encode_error(task_id: int, message: str) -> bytes:
+    return ERROR_HEADER.pack(CODEC_VERSION, task_id) + _pack_strings([message])
+
+def decode_error(payload) -> tuple[int, str]:
+    _check_version(payload)
+    _, task_id = ERROR_HEADER.unpack_from(payload)
+    (message,), _ = _unpack_strings(payload, ERROR_HEADER.size, 1)
+    return task_id, message
+
+def encode_batch(results: list[tuple[int, list]], progress: list[tuple[int, int, list]]) -> bytes:
+    # Many DONE / FOUND (results with no values are DONE) and PROGRESS entries in one message
+    parts = [BATCH_HEADER.pack(CODEC_VERSION, len(results), len(progress))]
+    for task_id, values in results:
+        parts.append(RESULT_ENTRY.pack(task_id, len(values)))
+        parts.append(_pack_values(values))
+    for task_id, done, values in progress:
+        parts.append(PROGRESS_ENTRY.pack(task_id, done, len(values)))
+        parts.append(_pack_values(values))
+    return b''.join(parts)
+
+def decode_batch(payload) -> tuple[list[tuple[int, list]], list[tuple[int, int, list]]]:
+    _check_version(payload)
+    _, result_count, progress_count = BATCH_HEADER.unpack_from(payload)
+    offset = BATCH_HEADER.size
+    results, progress = [], []
+    for _ in range(result_count):
+        task_id, count = RESULT_ENTRY.unpack_from(payload, offset)
+        values, offset = _unpack_values(payload, offset + RESULT_ENTRY.size, count)
+        results.append((task_id, values))
+    for _ in range(progress_count):
+        task_id, done, count = PROGRESS_ENTRY.unpack_from(payload, offset)
+        values, offset = _unpack_values(payload, offset + PROGRESS_ENTRY.size, count)
+        progress.append((task_id, done, values))
+    return results, progress
+
+def encode_files(file_ids: list[bytes]) -> bytes:
+    return FILES_HEADER.pack(CODEC_VERSION, len(file_ids)) + b''.join(file_ids)
+
+def decode_files(payload) -> list[bytes]:
+    _check_version(payload)
+    _, count = FILES_HEADER.unpack_from(payload)
+    offset = FILES_HEADER.size
+    return [bytes(payload[offset + i * FILE_ID_SIZE:offset + (i + 1) * FILE_ID_SIZE]) for i in range(count)]
+
+def encode_trace(spans: list[tuple]) -> bytes:
+    parts = [TRACE_HEADER.pack(CODEC_VERSION, len(spans))]
+    for name, task_id, start, end, track in spans:
+        parts.append(SPAN.pack(task_id, start, end))
+        parts.append(_pack_strings([name, track]))
+    return b''.join(parts)
+
+def decode_trace(payload) -> list[tuple]:
+    _check_version(payload)
+    _, count = TRACE_HEADER.unpack_from(payload)
+    offset = TRACE_HEADER.size
+    spans = []
+    for _ in range(count):
+        task_id, start, end = SPAN.unpack_from(payload, offset)
+        (name, track), offset = _unpack_strings(payload, offset + SPAN.size, 2)
+        spans.append((name, task_id, start, end, track))
+    return spans
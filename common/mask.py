@@ -0,0 +1,131 @@
+import itertools
+import math
+import struct
+from typing import Iterator
+
+# Charset mask keyspaces for both ends
+CHARSETS = {
+    'l': b'abcdefghijklmnopqrstuvwxyz',
+    'u': b'ABCDEFGHIJKLMNOPQRSTUVWXYZ',
+    'd': b'0123456789',
+    'h': b'0123456789abcdef',
+    'H': b'0123456789ABCDEF',
+    's': b' !"#$%&\'()*+,-./:;<=>?@[\\]^_`{|}~',
+}
+CHARSETS['a'] = CHARSETS['l'] + CHARSETS['u'] + CHARSETS['d'] + CHARSETS['s']
+CUSTOM_CHARSETS = '1234'
+SUFFIX_LIMIT = 4096  # most candidates sharing one prefix per block, i.e. size of a precomputed suffix table
+
+SPEC_HEADER = struct.Struct('!BB')  # min length, position count
+CHARSET_LENGTH = struct.Struct('!H')
+
+class Mask:
+    def __init__(self, charsets: list[bytes], min_length: int = None):
+        if not charsets or not all(charsets): raise Exception("A mask needs at least one position and no empty charsets")
+        self.charsets = [bytes(charset) for charset in charsets]
+        self.min_length = len(self.charsets) if min_length is None else min_length
+        if not 1 <= self.min_length <= len(self.charsets): raise Exception(f"Minimum length {self.min_length} outside 1..{len(self.charsets)}")
+
+        # Candidates are numbered shortest first; within one length the last position turns fastest
+        self.lengths: list[tuple[int, int, int]] = []  # length, first index, candidate count
+        self.size = 0
+        for length in range(self.min_length, len(self.charsets) + 1):
+            count = math.prod(len(charset) for charset in self.charsets[:length])
+            self.lengths.append((length, self.size, count))
+            self.size += count
+        self.suffix_tables: dict[int, tuple[int, list[bytes]]] = {}
+
+    @staticmethod
+    def _tokens(text: str, custom: list[bytes]) -> list[bytes]:
+        # One charset per position: ?l ?u ?d ?s ?a ?h ?H, ?1..?4 for custom charsets, ?? for a literal ?,
+        # anything else stands for itself
+        tokens = []
+        i = 0
+        while i < len(text):
+            if text[i] == '?' and i + 1 < len(text):
+                key = text[i + 1]
+                if key in CHARSETS: tokens.append(CHARSETS[key])
+                elif key in CUSTOM_CHARSETS and int(key) <= len(custom): tokens.append(custom[int(key) - 1])
+                elif key == '?': tokens.append(b'?')
+                else: raise Exception(f"Unknown charset ?{key}")
+                i += 2
+                continue
+            try:
+                tokens.append(text[i].encode('latin-1'))
+            except UnicodeEncodeError:
+                raise Exception(f"Mask character {text[i]!r} is not a single byte")
+            i += 1
+        return tokens
+
+    @staticmethod
+    def parse(mask: str, custom: list[str] = (), min_length: int = None) -> "Mask":
+        # Custom charsets may use the built-in ones, e.g. parse('?1?1?d', ['?l?u'])
+        custom_sets = [bytes(dict.fromkeys(b''.join(Mask._tokens(charset, [])))) for charset in custom]
+        return Mask(Mask._tokens(mask, custom_sets), min_length)
+
+    def to_spec(self) -> bytes:
+        parts = [SPEC_HEADER.pack(self.min_length, len(self.charsets))]
+        for charset in self.charsets:
+            parts.append(CHARSET_LENGTH.pack(len(charset)))
+            parts.append(charset)
+        return b''.join(parts)
+
+    @staticmethod
+    def from_spec(spec) -> "Mask":
+        min_length, count = SPEC_HEADER.unpack_from(spec)
+        offset = SPEC_HEADER.size
+        charsets = []
+        for _ in range(count):
+            (length,) = CHARSET_LENGTH.unpack_from(spec, offset)
+            offset += CHARSET_LENGTH.size
+            charsets.append(bytes(spec[offset:offset + length]))
+            offset += length
+        return Mask(charsets, min_length)
+
+    def digits(self, length: int, index: int) -> list[int]:
+        # Mixed-radix digits of an index within one length, last position least significant
+        digits = [0] * length
+        for position in range(length - 1, -1, -1):
+            index, digits[position] = divmod(index, len(self.charsets[position]))
+        return digits
+
+    def candidate(self, index: int) -> bytes:
+        for length, first, count in self.lengths:
+            if index < first + count:
+                return bytes(self.charsets[p][d] for p, d in enumerate(self.digits(length, index - first)))
+        raise Exception(f"Index {index} outside a keyspace of {self.size}")
+
+    def _suffix_table(self, length: int) -> tuple[int, list[bytes]]:
+        # As many trailing positions as fit in SUFFIX_LIMIT, expanded once; returns where they start
+        if length not in self.suffix_tables:
+            split, size = length, 1
+            while split > 0 and size * len(self.charsets[split - 1]) <= SUFFIX_LIMIT:
+                split -= 1
+                size *= len(self.charsets[split])
+            self.suffix_tables[length] = (split, [bytes(chars) for chars in itertools.product(*self.charsets[split:length])])
+        return self.suffix_tables[length]
+
+    def blocks(self, start: int, end: int) -> Iterator[tuple[bytes, list[bytes]]]:
+        # Yields (prefix, suffixes) covering candidates [start, end) in order. The prefix is an odometer
+        # over a reusable buffer: moving to the next block only rewrites the positions that turned over
+        for length, first, count in self.lengths:
+            low, high = max(start, first) - first, min(end, first + count) - first
+            if low >= high: continue
+            split, suffixes = self._suffix_table(length)
+            digits = self.digits(length, low)[:split]
+            prefix = bytearray(self.charsets[p][d] for p, d in enumerate(digits))
+            offset = low % len(suffixes)
+            while low < high:
+                take = min(len(suffixes) - offset, high - low)
+                yield bytes(prefix), suffixes if take == len(suffixes) else suffixes[offset:offset + take]
+                low += take
+                offset = 0
+                position = split - 1
+                while position >= 0:
+                    digits[position] += 1
+                    if digits[position] < len(self.charsets[position]):
+                        prefix[position] = self.charsets[position][digits[position]]
+                        break
+                    digits[position] = 0
+                    prefix[position] = self.charsets[position][0]
+                    position -= 1
@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import deque
+
+# Optional per-task timing spans for both ends
+TRACE_CAPACITY = 65536  # spans kept per process, and per worker on the server; the oldest are overwritten
+
+class Tracer:
+    def __init__(self, process: str, capacity: int = TRACE_CAPACITY):
+        self.process = process
+        self.capacity = capacity
+        self.spans: deque[tuple] = deque(maxlen=capacity)  # name, task id, start ns, end ns, track
+        self.remote: dict[str, deque] = {}  # spans sent by each worker, on their own clocks
+
+tracer: Tracer = None  # None while tracing is off, so every call below is a single check
+
+def enable(process: str, capacity: int = TRACE_CAPACITY):
+    global tracer
+    tracer = Tracer(process, capacity)
+
+def now() -> int:
+    return time.perf_counter_ns() if tracer else 0
+
+def record(name: str, start: int, task_id: int = 0, end: int = None, track: str = None):
+    if tracer is None: return
+    tracer.spans.append((name, task_id, start, end or time.perf_counter_ns(), track or threading.current_thread().name))
+
+def drain() -> list[tuple]:
+    # Single consumer; spans recorded by other threads meanwhile stay for the next drain
+    if tracer is None: return []
+    return [tracer.spans.popleft() for _ in range(len(tracer.spans))]
+
+def add_remote(source: str, spans: list[tuple]):
+    if tracer is None: return
+    tracer.remote.setdefault(source, deque(maxlen=tracer.capacity)).extend(spans)
+
+def clock_offset(local: list[tuple], remote: list[tuple]) -> int | None:
+    # Estimate of remote clock - local clock from causality: a worker decodes a task only after the server
+    # started sending it, and the server handles a result only after the worker started reporting it.
+    # Every task tightens one of the two bounds, and queueing on either side only loosens them, unlike
+    # a round-trip midpoint that assumes both directions take equally long
+    sent = {task_id: start for name, task_id, start, _, _ in local if name == "send"}
+    received = {task_id: start for name, task_id, start, _, _ in local if name == "result"}
+    upper = min((start - sent[task_id] for name, task_id, start, _, _ in remote if name == "decode" and task_id in sent), default=None)
+    lower = max((start - received[task_id] for name, task_id, start, _, _ in remote if name == "report" and task_id in received), default=None)
+    if upper is None or lower is None: return None
+    return (lower + upper) // 2
+
+def chrome_trace() -> dict:
+    # Chrome / Perfetto trace event JSON: one process per machine, one track per thread or pool core,
+    # with every worker timeline shifted onto the server's clock
+    if tracer is None: return {"traceEvents": []}
+    local = list(tracer.spans)
+    sources = [(tracer.process, local, 0)]
+    for source, spans in list(tracer.remote.items()):
+        spans = list(spans)
+        offset = clock_offset(local, spans)
+        if offset is None:
+            print(f"No task round trips with {source} to estimate its clock offset, leaving its timeline unshifted")
+            offset = 0
+        sources.append((source, spans, offset))
+
+    origin = min((start - offset for _, spans, offset in sources for _, _, start, _, _ in spans), default=0)
+    events = []
+    for pid, (process, spans, offset) in enumerate(sources, 1):
+        events.append({"ph": "M", "name": "process_name", "pid": pid, "args": {"name": process}})
+        tracks = {}
+        for name, task_id, start, end, track in spans:
+            if track not in tracks:
+                tracks[track] = len(tracks) + 1
+                events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": tracks[track], "args": {"name": track}})
+            events.append({
+                "name": name,
+                "ph": "X",
+                "pid": pid,
+                "tid": tracks[track],
+                "ts": (start - offset - origin) / 1000,
+                "dur": (end - start) / 1000,
+                "args": {"task": task_id},
+            })
+    return {"traceEvents": events, "displayTimeUnit": "ms"}
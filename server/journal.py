@@ -0,0 +1,128 @@
+import json
+import queue
+import sqlite3
+import threading
+import time
+
+FLUSH_INTERVAL = 0.5  # seconds between batched commits
+MAX_BATCH = 1000  # records per commit
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (job_id INTEGER PRIMARY KEY, action TEXT, targets TEXT, ranges TEXT, completed INTEGER DEFAULT 0);
+CREATE TABLE IF NOT EXISTS chunks (job_id INTEGER, start INTEGER, end INTEGER, done INTEGER);
+CREATE TABLE IF NOT EXISTS found (job_id INTEGER, digest TEXT, value TEXT);
+CREATE INDEX IF NOT EXISTS chunks_by_job ON chunks (job_id, done);
+'''
+# Added after the first release; journals created before them are migrated on open
+JOB_COLUMNS = {"wordlist": "TEXT", "priority": "INTEGER DEFAULT 0", "weight": "REAL DEFAULT 1.0", "mask": "BLOB"}
+
+class Journal:
+    def __init__(self, path: str):
+        self.path = path
+        self.records: queue.Queue = queue.Queue()
+        self.flushed = threading.Condition()
+        self.pending = 0
+
+        db = self.__open()
+        db.executescript(SCHEMA)
+        columns = [column[1] for column in db.execute('PRAGMA table_info(jobs)')]
+        for name, kind in JOB_COLUMNS.items():
+            if name not in columns: db.execute(f'ALTER TABLE jobs ADD COLUMN {name} {kind}')
+        db.close()
+        threading.Thread(target=self.__writer, daemon=True).start()
+
+    def __open(self) -> sqlite3.Connection:
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        return db
+
+    def __put(self, sql: str, args: tuple):
+        with self.flushed:
+            self.pending += 1
+        self.records.put((sql, args))
+
+    def __writer(self):
+        # Dispatch only enqueues; this thread groups records into one transaction per FLUSH_INTERVAL
+        db = self.__open()
+        while True:
+            batch = [self.records.get()]
+            deadline = time.monotonic() + FLUSH_INTERVAL
+            try:
+                while len(batch) < MAX_BATCH:
+                    batch.append(self.records.get(timeout=max(0, deadline - time.monotonic())))
+            except queue.Empty:
+                pass
+
+            try:
+                with db:
+                    for sql, args in batch:
+                        db.execute(sql, args)
+            except Exception as e:
+                print(f"Error writing {len(batch)} journal records: {e}")
+
+            with self.flushed:
+                self.pending -= len(batch)
+                self.flushed.notify_all()
+
+    def flush(self, timeout: float = None):
+        with self.flushed:
+            self.flushed.wait_for(lambda: self.pending == 0, timeout)
+
+    def record_job(self, job_id: int, action: str, targets: list[str], ranges: list[tuple[int, int]], wordlist: str = None, priority: int = 0, weight: float = 1.0, mask: bytes = None):
+        self.__put(
+            'INSERT OR REPLACE INTO jobs (job_id, action, targets, ranges, wordlist, priority, weight, mask) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (job_id, action, json.dumps(targets), json.dumps(ranges), wordlist, priority, weight, mask)
+        )
+
+    def record_issued(self, job_id: int, start: int, end: int):
+        self.__put('INSERT INTO chunks VALUES (?, ?, ?, 0)', (job_id, start, end))
+
+    def record_done(self, job_id: int, start: int, end: int):
+        self.__put('INSERT INTO chunks VALUES (?, ?, ?, 1)', (job_id, start, end))
+
+    def record_found(self, job_id: int, digest: str, value: str):
+        self.__put('INSERT INTO found VALUES (?, ?, ?)', (job_id, digest, value))
+
+    def record_completed(self, job_id: int):
+        self.__put('UPDATE jobs SET completed = 1 WHERE job_id = ?', (job_id,))
+
+    @staticmethod
+    def _subtract(ranges: list[tuple[int, int]], done: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        # Returns the parts of ranges not covered by done; either list may be unsorted or overlapping
+        done = sorted(done)
+        gaps = []
+        done_index = 0
+        for start, end in sorted(ranges):
+            while done_index < len(done) and done[done_index][1] <= start:
+                done_index += 1
+            cursor = start
+            index = done_index
+            while index < len(done) and done[index][0] < end:
+                done_start, done_end = done[index]
+                if done_start > cursor: gaps.append((cursor, done_start))
+                cursor = max(cursor, done_end)
+                index += 1
+            if cursor < end: gaps.append((cursor, end))
+        return gaps
+
+    def replay(self) -> tuple[list[dict], int]:
+        db = self.__open()
+        jobs = []
+        max_job_id = db.execute('SELECT COALESCE(MAX(job_id), 0) FROM jobs').fetchone()[0]
+        for job_id, action, targets, ranges, wordlist, priority, weight, mask in db.execute('SELECT job_id, action, targets, ranges, wordlist, priority, weight, mask FROM jobs WHERE completed = 0').fetchall():
+            done = db.execute('SELECT start, end FROM chunks WHERE job_id = ? AND done = 1 ORDER BY start', (job_id,)).fetchall()
+            results = dict(db.execute('SELECT digest, value FROM found WHERE job_id = ?', (job_id,)).fetchall())
+            jobs.append({
+                "job_id": job_id,
+                "action": action,
+                "targets": [target for target in json.loads(targets) if target not in results],
+                "results": results,
+                "ranges": self._subtract([tuple(r) for r in json.loads(ranges)], done),
+                "wordlist": wordlist,
+                "priority": priority,
+                "weight": weight,
+                "mask": mask,
+            })
+        db.close()
+        return jobs, max_job_id
@@ -1,40 +1,126 @@
+import bisect
 import itertools
-import pickle
+import json
+import os
+import sys
+import threading
 import time
+import zlib
+from collections import deque
 from typing import Generator, Iterator
-from socket_server import Connection, SocketServer
+
+# codec, cipher, mask and tracing are shared with the worker
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'common'))
+
+import codec
+import tracing
+from journal import Journal
+from mask import Mask
+from metrics import Metrics
+from socket_server import AsyncSocketServer, Connection, SocketServer
+from wordlist import SLICE_COMPRESSION, Wordlist
 
 class Action:
     MD5 = 'MD5'
     SHA256 = 'SHA256'
 
 MAX_TASK_SIZE = int(0.2 * 1024 * 1024)  # 0.2 MB
+TARGET_TASK_SECONDS = 5.0  # wall-clock time an adaptive chunk should take on one core
+MIN_CHUNK_SIZE = 10_000  # items
+INITIAL_CHUNK_SIZE = 100_000  # items, used until a connection's rate has been measured
+RATE_SMOOTHING = 0.3  # EWMA weight of the newest per-core rate sample
+MAX_TASK_FAILURES = 3  # ERROR reports for one chunk before its job is marked failed
+MESSAGE_DECODERS = {
+    'PROGRESS': codec.decode_progress,
+    'FOUND': codec.decode_result,
+    'DONE': codec.decode_result,
+    'ERROR': codec.decode_error,
+    'BATCH': codec.decode_batch,        # results and progress of many tasks, sent by relays
+    'CORES': lambda payload: int.from_bytes(payload, 'big'),
+    'FILES': codec.decode_files,
+    'TRACE': codec.decode_trace,
+}
 
 class Task:
-    def __init__(self, input_buffer: list, action: Action, expected_result: any):
+    job_ids = itertools.count(1)
+
+    def __init__(self, input_buffer: list, action: Action, expected_result: str | list[str], job_id: int = 0, wordlist: Wordlist = None, mask: Mask = None):
         self.input_buffer = input_buffer
         self.action = action
-        self.expected_result = expected_result
-        self.id = id(self)
+        self.expected_result = [expected_result] if isinstance(expected_result, str) else expected_result
+        self.job_id = job_id
+        self.wordlist = wordlist  # set when input_buffer holds byte ranges of a wordlist
+        self.mask = mask  # set when input_buffer holds index ranges into a mask keyspace
+        self.progress = 0
+        self.failures = 0  # ERROR reports so far, carried over to requeued remainders
+        self.id = 0  # assigned by the orchestrator at dispatch
+
+    def split_input(self, done: int) -> tuple[list, list]:
+        # Splits input_buffer into the first `done` items and the rest, cutting range descriptors in place
+        if self.input_buffer and type(self.input_buffer[0]) is bytes:
+            return self.__split_slices(done)
+        if not self.input_buffer or type(self.input_buffer[0]) is not tuple:
+            return self.input_buffer[:done], self.input_buffer[done:]
+        finished, remaining = [], []
+        for start, end in self.input_buffer:
+            cut = min(end, start + max(0, done))
+            done -= cut - start
+            if cut > start: finished.append((start, cut))
+            if end > cut: remaining.append((cut, end))
+        return finished, remaining
+
+    def __split_slices(self, done: int) -> tuple[list, list]:
+        # Compressed wordlist slices (e.g. passed on by a relay) report progress in decompressed bytes,
+        # which always fall on a line start
+        finished, remaining = [], []
+        for item in self.input_buffer:
+            if done <= 0:
+                remaining.append(item)
+                continue
+            data = zlib.decompress(item)
+            cut = min(len(data), done)
+            done -= cut
+            finished.append(item if cut == len(data) else zlib.compress(data[:cut], SLICE_COMPRESSION))
+            if cut < len(data): remaining.append(zlib.compress(data[cut:], SLICE_COMPRESSION))
+        return finished, remaining
     
     @staticmethod
     def get_chunks(
-        data_gen: Generator,
+        data_gen: Generator | range | Mask,
         total_size: int,
         chunk_count: int,
         action: Action,
-        expected_result: any,
-        max_chunk_size: int = -1
+        expected_result: str | list[str],
+        max_chunk_size: int = -1,
+        job_id: int = None
     ) -> tuple[Generator, int]:
     
         if chunk_count <= 0: chunk_count = 1
+        if job_id is None: job_id = next(Task.job_ids)
+        # Every chunk of a job shares one target list
+        expected_result = [expected_result] if isinstance(expected_result, str) else list(expected_result)
+
+        # A mask is split like range(mask.size); workers map the indices back to candidates
+        mask = data_gen if isinstance(data_gen, Mask) else None
+        if mask: data_gen = range(mask.size)
 
-        if total_size // chunk_count > max_chunk_size:
+        # Range descriptors serialize to a fixed size, so the byte cap only applies to materialized items
+        is_range = isinstance(data_gen, range)
+        if is_range: total_size = len(data_gen)
+        elif max_chunk_size > 0 and total_size // chunk_count > max_chunk_size:
             chunk_count = total_size // max_chunk_size
                 
         base_chunk_size = total_size // chunk_count
         print(f"Dividing {total_size} items into {chunk_count} chunks of ~{base_chunk_size} items each")
 
+        def _range_gen() -> Iterator[Task]:
+            start = data_gen.start
+            for i in range(chunk_count):
+                target_size = base_chunk_size + (total_size % chunk_count if i == chunk_count - 1 else 0)
+                if target_size <= 0: continue
+                yield Task([(start, start + target_size)], action, expected_result, job_id, mask=mask)
+                start += target_size
+
         def _gen() -> Iterator[Task]:
             for i in range(chunk_count):
                 chunk = []
@@ -45,35 +131,383 @@ class Task:
                     except StopIteration:
                         break
                 if chunk:
-                    yield Task(chunk, action, expected_result)
+                    yield Task(chunk, action, expected_result, job_id)
 
-        return _gen(), chunk_count
+        return (_range_gen() if is_range else _gen()), chunk_count
 
-class TaskOrchestrator:
+class AdaptiveChunker:
+    def __init__(
+        self,
+        keyspace: range | list[tuple[int, int]],
+        action: Action,
+        expected_result: str | list[str],
+        target_seconds: float = TARGET_TASK_SECONDS,
+        min_chunk_size: int = MIN_CHUNK_SIZE,
+        initial_chunk_size: int = INITIAL_CHUNK_SIZE,
+        job_id: int = None
+    ):
+        # A plain range, or the uncompleted gaps of a job resumed from the journal
+        ranges = [(keyspace.start, keyspace.stop)] if isinstance(keyspace, range) else keyspace
+        self.ranges: deque[tuple[int, int]] = deque((start, end) for start, end in ranges if end > start)
+        self.remaining = sum(end - start for start, end in self.ranges)
+        self.action = action
+        self.expected_result = [expected_result] if isinstance(expected_result, str) else list(expected_result)
+        self.target_seconds = target_seconds
+        self.min_chunk_size = min_chunk_size
+        self.initial_chunk_size = initial_chunk_size
+        self.job_id = next(Task.job_ids) if job_id is None else job_id
+        self.wordlist: Wordlist = None
+        self.mask: Mask = None
+        self.item_size = 1  # keyspace units per hashed item
+
+    def next_task(self, core_rate: float | None, fleet_share: float) -> Task | None:
+        # Sized to take target_seconds on the requesting core, but never more than half of its fair
+        # share of what is left (fleet_share is the core's fraction of the fleet's measured throughput),
+        # so chunks shrink toward the end of the job and the tail stays short
+        if not self.remaining: return None
+        size = core_rate * self.target_seconds if core_rate else self.initial_chunk_size
+        size = min(size * self.item_size, self.remaining * fleet_share / 2)
+        size = max(int(self.min_chunk_size * self.item_size), int(size))
+
+        start, end = self.ranges.popleft()
+        cut = self.wordlist.align(start + size) if self.wordlist else start + size
+        if end > cut: self.ranges.appendleft((cut, end))
+        else: cut = end
+        self.remaining -= cut - start
+        return Task([(start, cut)], self.action, self.expected_result, self.job_id, self.wordlist, self.mask)
+
+    def cancel(self):
+        self.ranges.clear()
+        self.remaining = 0
+
+class WordlistChunker(AdaptiveChunker):
+    def __init__(
+        self,
+        wordlist: Wordlist,
+        action: Action,
+        expected_result: str | list[str],
+        target_seconds: float = TARGET_TASK_SECONDS,
+        min_chunk_size: int = MIN_CHUNK_SIZE,
+        initial_chunk_size: int = INITIAL_CHUNK_SIZE,
+        job_id: int = None,
+        keyspace: list[tuple[int, int]] = None
+    ):
+        # The keyspace is byte offsets into the file; sizes stay in lines and are converted with the average line length
+        super().__init__(range(wordlist.size) if keyspace is None else keyspace, action, expected_result, target_seconds, min_chunk_size, initial_chunk_size, job_id)
+        self.wordlist = wordlist
+        self.item_size = wordlist.line_bytes
+
+class MaskChunker(AdaptiveChunker):
+    def __init__(
+        self,
+        mask: Mask,
+        action: Action,
+        expected_result: str | list[str],
+        target_seconds: float = TARGET_TASK_SECONDS,
+        min_chunk_size: int = MIN_CHUNK_SIZE,
+        initial_chunk_size: int = INITIAL_CHUNK_SIZE,
+        job_id: int = None,
+        keyspace: list[tuple[int, int]] = None
+    ):
+        # The keyspace is candidate indices, so nothing is generated up front however large the mask is
+        super().__init__(range(mask.size) if keyspace is None else keyspace, action, expected_result, target_seconds, min_chunk_size, initial_chunk_size, job_id)
+        self.mask = mask
+
+class IntervalSet:
+    # Sorted, merged [start, end) runs of ints. Task ids are handed out in dispatch order and retire
+    # at roughly that pace, so the set stays a few runs long however many tasks have been through it
     def __init__(self):
+        self.starts: list[int] = []
+        self.ends: list[int] = []
+        self.count = 0
+
+    def __contains__(self, value: int) -> bool:
+        i = bisect.bisect_right(self.starts, value) - 1
+        return i >= 0 and value < self.ends[i]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def add(self, value: int):
+        i = bisect.bisect_right(self.starts, value) - 1
+        if i >= 0 and value < self.ends[i]: return
+        self.count += 1
+        joins_left = i >= 0 and self.ends[i] == value
+        joins_right = i + 1 < len(self.starts) and self.starts[i + 1] == value + 1
+        if joins_left and joins_right:
+            self.ends[i] = self.ends.pop(i + 1)
+            self.starts.pop(i + 1)
+        elif joins_left:
+            self.ends[i] = value + 1
+        elif joins_right:
+            self.starts[i + 1] = value
+        else:
+            self.starts.insert(i + 1, value)
+            self.ends.insert(i + 1, value + 1)
+
+class TaskRegistry:
+    def __init__(self):
+        self.ids = itertools.count(1)
+        self.tasks: dict[int, tuple[Connection, Task]] = {}
+        self.by_connection: dict[Connection, dict[int, Task]] = {}
+        self.retired = IntervalSet()  # ids that finished, were dropped or were reassigned
+
+    def __len__(self) -> int:
+        return len(self.tasks)
+
+    def add_connection(self, conn: Connection):
+        self.by_connection[conn] = {}
+
+    def remove_connection(self, conn: Connection) -> list[Task]:
+        tasks = list(self.by_connection.pop(conn, {}).values())
+        for task in tasks:
+            del self.tasks[task.id]
+            self.retired.add(task.id)
+        return tasks
+
+    def assign(self, conn: Connection, task: Task):
+        task.id = next(self.ids)
+        self.tasks[task.id] = (conn, task)
+        self.by_connection[conn][task.id] = task
+
+    def get(self, task_id: int, conn: Connection = None) -> Task | None:
+        owner = self.tasks.get(task_id)
+        if owner is None or (conn is not None and owner[0] is not conn): return None
+        return owner[1]
+
+    def pop(self, task_id: int, conn: Connection = None) -> tuple[Connection, Task] | None:
+        # Only the connection a task was sent to may finish it
+        if self.get(task_id, conn) is None: return None
+        owner = self.tasks.pop(task_id)
+        del self.by_connection[owner[0]][task_id]
+        self.retired.add(task_id)
+        return owner
+
+    def of_job(self, job_id: int) -> list[tuple[Connection, Task]]:
+        return [owner for owner in self.tasks.values() if owner[1].job_id == job_id]
+
+class Job:
+    QUEUED = "queued"
+    RUNNING = "running"
+    EXHAUSTED = "exhausted"  # every chunk searched, some targets not found
+    FOUND = "found"
+    CANCELLED = "cancelled"
+    FAILED = "failed"  # one chunk failed on workers MAX_TASK_FAILURES times
+
+    def __init__(
+        self,
+        job_id: int,
+        action: Action,
+        targets: list[str],
+        source: AdaptiveChunker | Iterator[Task],
+        priority: int = 0,
+        weight: float = 1.0,
+        total_tasks: int = 0
+    ):
+        if not targets: raise Exception(f"Job {job_id} has no targets")
+        self.id = job_id
+        self.action = action
+        self.targets = list(targets)
+        self.remaining_targets = set(targets)
+        self.results: dict[str, str] = {}
+        self.found_digests: list[str] = []  # in the order they were found, so workers are only sent the new ones
+        self.source = source  # an AdaptiveChunker, or an iterator of pre-split tasks
+        self.priority = priority
+        self.weight = max(weight, 1e-9)
+        self.requeued: deque[Task] = deque()
+        self.peeked: Task | None = None
+
+        self.state = Job.QUEUED
+        self.total_tasks = total_tasks
+        self.tasks_issued = 0  # tasks handed out for the first time, i.e. not requeued remainders
+        self.tasks_done = 0
+        self.tasks_in_flight = 0
+        # Keyspace units, like the chunker's: candidates, or bytes for wordlist jobs
+        self.items_total = source.remaining if isinstance(source, AdaptiveChunker) else None
+        self.items_done = 0
+        self.share = 0.0  # work dispatched / weight; the job with the lowest share in its priority goes next
+        self.submitted_at = time.time()
+        self.finished_at: float = None
+
+    @property
+    def stopped(self) -> bool:
+        return self.state in (Job.FOUND, Job.CANCELLED, Job.FAILED)
+
+    @property
+    def finished(self) -> bool:
+        return self.state in (Job.EXHAUSTED, Job.FOUND, Job.CANCELLED, Job.FAILED)
+
+    def has_work(self) -> bool:
+        if self.stopped: return False
+        if self.requeued or self.peeked: return True
+        if isinstance(self.source, AdaptiveChunker): return self.source.remaining > 0
+        self.peeked = next(self.source, None)
+        return self.peeked is not None
+
+    def next_task(self, core_rate: float | None, fleet_share: float) -> Task | None:
+        if self.requeued: return self.requeued.popleft()
+        if self.peeked:
+            task, self.peeked = self.peeked, None
+        elif not isinstance(self.source, AdaptiveChunker):
+            task = next(self.source, None)
+        else:
+            task = self.source.next_task(core_rate, fleet_share)
+            if task: self.total_tasks += 1
+        if task: self.tasks_issued += 1
+        return task
+
+    def stop(self, state: str) -> int:
+        # Returns how many queued tasks were dropped without ever being dispatched
+        dropped = len(self.requeued) + self.total_tasks - self.tasks_issued
+        if isinstance(self.source, AdaptiveChunker): self.source.cancel()
+        else: self.source = iter([])
+        self.requeued.clear()
+        self.peeked = None
+        self.state = state
+        self.finished_at = time.time()
+        return dropped
+
+    def status(self) -> dict:
+        return {
+            "id": self.id,
+            "state": self.state,
+            "action": self.action,
+            "priority": self.priority,
+            "weight": self.weight,
+            "tasks_done": self.tasks_done,
+            "tasks_total": self.total_tasks,
+            "tasks_in_flight": self.tasks_in_flight,
+            "items_done": self.items_done,
+            "items_total": self.items_total,
+            "found": len(self.results),
+            "results": dict(self.results),
+            "targets": len(self.targets),
+            "elapsed": (self.finished_at or time.time()) - self.submitted_at,
+        }
+
+class TaskOrchestrator:
+    def __init__(self, credits_per_core: int = 1, metrics_port: int = None, transport: str = "asyncio", journal_path: str = None, trace_capacity: int = 0):
         self.callbacks = {
             "on_message": self.on_message,
             "on_disconnect": self.on_disconnect,
             "on_connect": self.on_connect
         }
 
-        self.server = SocketServer(callbacks=self.callbacks)
-        self.cores = []
+        self.server = AsyncSocketServer(callbacks=self.callbacks) if transport == "asyncio" else SocketServer(callbacks=self.callbacks)
+        self.credits_per_core = credits_per_core
+        self.credits: dict[Connection, int] = {}
+        self.dispatch_ready = threading.Condition()
 
+        self.jobs: dict[int, Job] = {}  # every submitted job by id; tasks reach theirs through task.job_id
+        self.active_jobs: dict[int, Job] = {}
         self.total_tasks = 0
-        self.pending_tasks: Iterator[Task] = iter([])
-        self.ongoing_tasks: dict[Connection, list[Task]] = {}
-        self.finished_tasks = []
+        self.core_rates: dict[Connection, float] = {}
+        self.registry = TaskRegistry()
+        self.finished_tasks = 0
+        self.in_flight = 0
+        self.cancelled_tasks = 0
         self.start_time = 0
-    
+
+        self.journal = Journal(journal_path) if journal_path else None
+        self.journaled_jobs: set[int] = set()
+
+        self.metrics_port = metrics_port
+        self.metrics = Metrics()
+        self.metrics.gauges = {
+            "queue_depth": lambda: self.total_tasks - self.finished_tasks - self.cancelled_tasks - self.in_flight,
+            "tasks_in_flight": lambda: self.in_flight,
+            "connections": lambda: len(self.credits),
+            "free_credits": lambda: sum(self.credits.values()),
+            "jobs_active": lambda: len(self.active_jobs),
+        }
+        if trace_capacity: tracing.enable("server", trace_capacity)
+
     def start(self):
+        if self.journal: self.resume()
         self.server.start()
-    
-    def add_tasks(self, tasks: Iterator[Task], tasks_len: int):
-        self.total_tasks += tasks_len
-        self.pending_tasks = itertools.chain(self.pending_tasks, tasks)
+        if self.metrics_port is not None:
+            self.metrics.serve(port=self.metrics_port)
+
+    def resume(self):
+        jobs, max_job_id = self.journal.replay()
+        Task.job_ids = itertools.count(max_job_id + 1)
+        for job in jobs:
+            if not job["targets"] or not job["ranges"]:
+                self.journal.record_completed(job["job_id"])
+                continue
+            if job["wordlist"]:
+                source = WordlistChunker(Wordlist(job["wordlist"]), job["action"], job["targets"], job_id=job["job_id"], keyspace=job["ranges"])
+            elif job["mask"]:
+                source = MaskChunker(Mask.from_spec(job["mask"]), job["action"], job["targets"], job_id=job["job_id"], keyspace=job["ranges"])
+            else:
+                source = AdaptiveChunker(job["ranges"], job["action"], job["targets"], job_id=job["job_id"])
+            self.journaled_jobs.add(source.job_id)
+            resumed = self.add_source(source, job["priority"], job["weight"])
+            resumed.results.update(job["results"])
+            print(f"Resumed job {source.job_id}: {source.remaining} items in {len(source.ranges)} ranges left, {len(job['targets'])} targets left")
+
+    def __submit(self, job: Job) -> Job:
+        with self.dispatch_ready:
+            # A late job starts level with the least-served job of its priority instead of at zero,
+            # so it gets its fair share from now on rather than monopolizing the fleet to catch up
+            peers = [other.share for other in self.active_jobs.values() if other.priority == job.priority]
+            job.share = min(peers, default=0.0)
+            self.jobs[job.id] = job
+            self.active_jobs[job.id] = job
+            self.total_tasks += job.total_tasks
+            self.dispatch_ready.notify()
+        print(f"Submitted job {job.id} ({job.action}, {len(job.targets)} targets, priority {job.priority}, weight {job.weight})")
+        return job
+
+    def add_tasks(self, tasks: Iterator[Task], tasks_len: int, priority: int = 0, weight: float = 1.0) -> Job:
+        first = next(tasks, None)
+        if first is None: return None
+        job_id = first.job_id or next(Task.job_ids)
+        return self.__submit(Job(job_id, first.action, first.expected_result, itertools.chain([first], tasks), priority, weight, tasks_len))
+
+    def add_source(self, source: AdaptiveChunker, priority: int = 0, weight: float = 1.0) -> Job:
+        job = Job(source.job_id, source.action, source.expected_result, source, priority, weight)
+        if self.journal and source.job_id not in self.journaled_jobs:
+            self.journal.record_job(
+                source.job_id, source.action, source.expected_result, list(source.ranges),
+                source.wordlist.path if source.wordlist else None, priority, weight, source.mask.to_spec() if source.mask else None
+            )
+            self.journaled_jobs.add(source.job_id)
+        return self.__submit(job)
+
+    def job_status(self, job_id: int = None) -> dict | list[dict]:
+        with self.dispatch_ready:
+            if job_id is not None: return self.jobs[job_id].status()
+            return [job.status() for job in self.jobs.values()]
+
+    def forget_job(self, job_id: int):
+        # Drops a finished job, for callers like relays that would otherwise keep every chunk they ever ran
+        with self.dispatch_ready:
+            job = self.jobs.get(job_id)
+            if job is not None and job.finished: del self.jobs[job_id]
+
+    def unsearched(self, job_id: int) -> list[tuple[int, int]]:
+        # Ranges of a range or mask job not searched yet: left in its source, requeued, or in flight past their last checkpoint
+        with self.dispatch_ready:
+            job = self.jobs[job_id]
+            ranges = list(job.source.ranges) if isinstance(job.source, AdaptiveChunker) else []
+            for task in job.requeued: ranges.extend(task.input_buffer)
+            for _, task in self.registry.of_job(job_id): ranges.extend(task.split_input(task.progress)[1])
+            return ranges
+
+    @property
+    def core_count(self) -> int:
+        return sum(conn.cores for conn in self.credits)
+
+    def __estimated_rates(self) -> dict[Connection, float]:
+        # Measured per-core hashes/s of every connection; one without a DONE yet is assumed average
+        known = [self.core_rates[conn] for conn in self.credits if conn in self.core_rates]
+        default = sum(known) / len(known) if known else 1.0
+        return {conn: self.core_rates.get(conn, default) for conn in self.credits}
 
     def _len_of_expanded_task(self, input_buffer) -> int:
+        if type(input_buffer[0]) is tuple:
+            return sum(end - start for start, end in input_buffer)
         if type(input_buffer[0]) is str and "-" in input_buffer[0]:
             length = 0
             for item in input_buffer:
@@ -83,109 +517,395 @@ class TaskOrchestrator:
             return length
         return len(input_buffer)
 
+    def _task_items(self, task: Task) -> int:
+        items = self._len_of_expanded_task(task.input_buffer)
+        return round(items / task.wordlist.line_bytes) if task.wordlist else items
+
+    def _wire_input(self, connection: Connection, task: Task) -> list:
+        if task.mask: return [(task.mask, start, end) for start, end in task.input_buffer]
+        if not task.wordlist: return task.input_buffer
+        # Workers holding the same file get offsets into it; the rest get the bytes themselves, compressed
+        if task.wordlist.id in connection.files:
+            return [(task.wordlist.id, start, end - start) for start, end in task.input_buffer]
+        return [task.wordlist.slice(start, end) for start, end in task.input_buffer]
+
+    def export_trace(self, path: str):
+        # Server and worker spans on one timeline; open in chrome://tracing or ui.perfetto.dev
+        trace = tracing.chrome_trace()
+        with open(path, 'w') as f:
+            json.dump(trace, f)
+        print(f"Wrote {len(trace['traceEvents'])} trace events to {path}")
+
     def __send_task(self, connection: Connection, task: Task):
-        print(f"Sending task {task.id} to {connection.addr[0]} ({len(task.input_buffer)} items)")
+        with self.dispatch_ready:
+            job = self.jobs.get(task.job_id)
+            # Stopped (and maybe forgotten) since it was dispatched; the task was dropped with it
+            if job is None or job.stopped: return
+            # A worker gets a job's targets once, then only the digests found since its last task of the job
+            targets = None if job.id in connection.jobs else [target for target in job.targets if target in job.remaining_targets]
+            found = [] if targets is not None else job.found_digests[connection.jobs[job.id]:]
+            connection.jobs[job.id] = len(job.found_digests)
+        print(f"Sending task {task.id} to {connection.addr[0]} ({self._task_items(task)} items)")
+        self.metrics.task_dispatched(task.id)
+        start = tracing.now()
+        if targets is not None: job_payload = codec.encode_job(job.id, targets)
+        payload = codec.encode_task(task.id, task.job_id, task.action, found, self._wire_input(connection, task))
+        tracing.record("encode", start, task.id)
+        start = tracing.now()
+        if targets is not None:
+            connection.send_fields([
+                'JOB',                              # ID
+                job_payload,                        # Job ID + targets not found yet
+            ])
         connection.send_fields([
             'TASK',                                 # ID
-            pickle.dumps(task),                     # Task object
+            payload,                                # Task ID + job ID + action + newly found targets + input
         ])
+        tracing.record("send", start, task.id)
 
-    def handle_tasks(self):
+    def __is_finished(self) -> bool:
+        return not self.active_jobs
+
+    def __next_job(self) -> Job | None:
+        # Called with dispatch_ready held; strict priority between levels, weighted fair share within one
+        best = None
+        for job in self.active_jobs.values():
+            if not job.has_work(): continue
+            if best is None or (-job.priority, job.share, job.id) < (-best.priority, best.share, best.id): best = job
+        return best
+
+    def __next_dispatch(self) -> tuple[Connection, Task] | None:
+        # Called with dispatch_ready held; the fastest cores with a free slot go first, so when work
+        # runs short (the end of a job, pre-split tasks) it lands where it finishes soonest
+        start = tracing.now()
+        rates = self.__estimated_rates()
+        connection = max((conn for conn, free in self.credits.items() if free > 0), key=lambda conn: (rates[conn], self.credits[conn]), default=None)
+        if connection is None: return None
+        job = self.__next_job()
+        if job is None: return None
+        fleet_rate = sum(rate * conn.cores for conn, rate in rates.items())
+        known = job.total_tasks
+        task = job.next_task(self.core_rates.get(connection), rates[connection] / fleet_rate)
+        if task is None: return None
+        # Chunks an AdaptiveChunker carves on demand join the total as they are made
+        self.total_tasks += job.total_tasks - known
+
+        task.job_id = job.id
+        if job.id in self.journaled_jobs:
+            for low, high in task.input_buffer: self.journal.record_issued(job.id, low, high)
+        job.state = Job.RUNNING
+        job.tasks_in_flight += 1
+        job.share += self._task_items(task) / job.weight
+        self.credits[connection] -= 1
+        self.in_flight += 1
+        self.registry.assign(connection, task)
+        tracing.record("dispatch", start, task.id)
+        return connection, task
+
+    def handle_tasks(self, until_idle: bool = True):
+        # With until_idle=False the dispatcher keeps serving jobs submitted later instead of returning
         self.start_time = time.time()
-        index = 0
-        while len(self.finished_tasks) != self.total_tasks:
-            if not self.pending_tasks or len(self.cores) == 0: continue
-            
-            connection = self.cores[index % len(self.cores)]
-
-            task = next(self.pending_tasks, None)
-            if task is None: continue
-            self.ongoing_tasks[connection].append(task)
-            self.__send_task(connection, task)
-            index += 1
-           
-
-    def __finish_task(self, task_id: int):
-        for conn, tasks in self.ongoing_tasks.items():
-            for task in tasks:
-                if task.id == int(task_id):
-                    tasks.remove(task)
-                    self.finished_tasks.append(task)
-                    return task
-
-    def __reassign_task(self, task: Task):
-        if task.id in self.ongoing_tasks:
-            task, conn = self.ongoing_tasks.pop(task.id)
-            self.pending_tasks.append(task)
-            print(f"Task {task.id} reassigned from {conn}")
+        self.metrics.reset_clock()
+        while True:
+            with self.dispatch_ready:
+                while True:
+                    dispatch = self.__next_dispatch()
+                    if dispatch or (until_idle and self.__is_finished()): break
+                    # Woken by completions, cancellations, new connections and newly submitted jobs
+                    self.dispatch_ready.wait()
+                if dispatch is None: break
+
+            connection, task = dispatch
+            try:
+                self.__send_task(connection, task)
+            except Exception as e:
+                print(f"Error sending task {task.id} to {connection.addr[0]}: {e}")
+
+        if self.journal: self.journal.flush()
+
+    def __check_job(self, job: Job) -> bool:
+        # Called with dispatch_ready held, whenever one of the job's tasks leaves the fleet; True if that exhausted the job
+        if job.finished or job.tasks_in_flight or job.has_work(): return False
+        job.state = Job.EXHAUSTED
+        job.finished_at = time.time()
+        self.active_jobs.pop(job.id, None)
+        if job.id in self.journaled_jobs: self.journal.record_completed(job.id)
+        print(f"Job {job.id} searched its whole keyspace, {len(job.remaining_targets)} of {len(job.targets)} targets not found")
+        return True
+
+    def __release_job(self, job_id: int):
+        # Workers hold a job's targets until told it is over; with nothing left in flight, CANCEL JOB only frees them
+        with self.dispatch_ready:
+            connections = [conn for conn in self.credits if conn.jobs.pop(job_id, None) is not None]
+        for conn in connections:
+            self.__send_cancel(conn, 'JOB', job_id)
+
+    def __finish_task(self, conn: Connection, task_id: int) -> Task | None:
+        with self.dispatch_ready:
+            owner = self.registry.pop(task_id, conn)
+            if owner is None: return None
+            task = owner[1]
+            self.finished_tasks += 1
+            self.in_flight -= 1
+            if conn in self.credits: self.credits[conn] += 1
+            job = self.jobs[task.job_id]
+            job.tasks_in_flight -= 1
+            job.tasks_done += 1
+            job.items_done += self._len_of_expanded_task(task.input_buffer)
+            self.dispatch_ready.notify()
+            return task
+
+    def __drop_task(self, conn: Connection, task: Task):
+        # Called with dispatch_ready held
+        self.registry.pop(task.id)
+        self.cancelled_tasks += 1
+        self.in_flight -= 1
+        self.jobs[task.job_id].tasks_in_flight -= 1
+        if conn in self.credits: self.credits[conn] += 1
+        self.metrics.task_dropped(task.id)
+
+    def __send_cancel(self, connection: Connection, scope: str, target_id: int):
+        try:
+            connection.send_fields([
+                'CANCEL',           # ID
+                scope,              # TASK / JOB
+                str(target_id)      # Task or job ID
+            ])
+        except Exception as e:
+            print(f"Error sending CANCEL to {connection.addr[0]}: {e}")
+
+    def cancel_task(self, task_id: int):
+        # Stops one task on its worker; the part it had not searched yet goes back to its job
+        with self.dispatch_ready:
+            owner = self.registry.pop(task_id)
+            if owner is None: return
+            conn, task = owner
+            self.in_flight -= 1
+            if conn in self.credits: self.credits[conn] += 1
+            self.metrics.task_dropped(task.id)
+            exhausted = self.__reassign_task(task, conn)
+            self.dispatch_ready.notify()
+        self.__send_cancel(conn, 'TASK', task_id)
+        if exhausted: self.__release_job(task.job_id)
+
+    def __stop_job(self, job_id: int, state: str):
+        with self.dispatch_ready:
+            job = self.jobs.get(job_id)
+            if job is None or job.finished: return
+            self.cancelled_tasks += job.stop(state)
+            self.active_jobs.pop(job_id, None)
+            if job_id in self.journaled_jobs: self.journal.record_completed(job_id)
+            for conn, task in self.registry.of_job(job_id):
+                self.__drop_task(conn, task)
+            connections = list(self.registry.by_connection)
+            for conn in connections: conn.jobs.pop(job_id, None)
+            self.dispatch_ready.notify()
+
+        print(f"Job {job_id} {state}, cancelling its remaining tasks on {len(connections)} connections")
+        for conn in connections:
+            self.__send_cancel(conn, 'JOB', job_id)
+
+    def complete_job(self, job_id: int):
+        self.__stop_job(job_id, Job.FOUND)
+
+    def cancel_job(self, job_id: int):
+        self.__stop_job(job_id, Job.CANCELLED)
+
+    def __record_found(self, job_id: int, values: list[tuple[str, str]]):
+        with self.dispatch_ready:
+            job = self.jobs.get(job_id)
+            if job is None or job.stopped: return
+            for value, digest in values:
+                if digest in job.remaining_targets:
+                    job.remaining_targets.discard(digest)
+                    job.results[digest] = value
+                    job.found_digests.append(digest)
+                    if job_id in self.journaled_jobs: self.journal.record_found(job_id, digest, value)
+            if job.remaining_targets:
+                print(f"Job {job_id} has {len(job.remaining_targets)} targets left")
+                return
+        self.complete_job(job_id)
+
+    def __reassign_task(self, task: Task, conn: Connection) -> bool:
+        # Called with dispatch_ready held; only the part after the last PROGRESS checkpoint is redone.
+        # True if that exhausted the job
+        job = self.jobs[task.job_id]
+        job.tasks_in_flight -= 1
+        finished, remaining = task.split_input(task.progress)
+        if job.id in self.journaled_jobs and finished and type(finished[0]) is tuple:
+            for start, end in finished:
+                self.journal.record_done(task.job_id, start, end)
+
+        if job.stopped:
+            self.cancelled_tasks += 1
+        elif not remaining:
+            self.finished_tasks += 1
+            job.tasks_done += 1
+            job.items_done += self._len_of_expanded_task(task.input_buffer)
+        else:
+            retry = Task(remaining, task.action, task.expected_result, task.job_id, task.wordlist, task.mask)
+            retry.failures = task.failures
+            job.items_done += self._len_of_expanded_task(task.input_buffer) - self._len_of_expanded_task(remaining)
+            job.requeued.append(retry)
+            print(f"Task {task.id} reassigned from {conn.addr} ({task.progress} items already done)")
+        return self.__check_job(job)
 
     def on_disconnect(self, conn: Connection):
-        if conn in self.ongoing_tasks:
-            self.cores = [c for c in self.cores if c != conn]
-            tasks = self.ongoing_tasks.pop(conn)
-            print(f"Connection {conn.addr} disconnected, reassigning {len(tasks)} tasks")
-            for task in tasks:
-                self.__reassign_task(task)
+        exhausted = []
+        with self.dispatch_ready:
+            if conn in self.registry.by_connection:
+                self.credits.pop(conn, None)
+                self.core_rates.pop(conn, None)
+                tasks = self.registry.remove_connection(conn)
+                self.in_flight -= len(tasks)
+                print(f"Connection {conn.addr} disconnected, reassigning {len(tasks)} tasks")
+                for task in tasks:
+                    self.metrics.task_dropped(task.id)
+                    if self.__reassign_task(task, conn): exhausted.append(task.job_id)
+                self.dispatch_ready.notify()
+        for job_id in exhausted:
+            self.__release_job(job_id)
+
+    def __handle_error(self, connection: Connection, task_id: int, message: str):
+        # The worker could not run the task; the unfinished remainder goes back to the job like after a disconnect
+        print(f"Task {task_id} failed on {connection.addr[0]}: {message}")
+        with self.dispatch_ready:
+            owner = self.registry.pop(task_id, connection)
+            if owner is None: return
+            task = owner[1]
+            self.in_flight -= 1
+            if connection in self.credits: self.credits[connection] += 1
+            self.metrics.task_dropped(task.id)
+            task.failures += 1
+            exhausted = self.__reassign_task(task, connection)
+            self.dispatch_ready.notify()
+        if exhausted: self.__release_job(task.job_id)
+        if task.failures >= MAX_TASK_FAILURES:
+            print(f"Task {task_id} failed {task.failures} times, giving up on job {task.job_id}")
+            self.__stop_job(task.job_id, Job.FAILED)
 
     def on_connect(self, conn: Connection):
         print(f"New connection established: {conn.addr}")
-        conn.connect()
-        self.ongoing_tasks[conn] = []
-        self.cores.extend([conn] * conn.cores)
+        with self.dispatch_ready:
+            self.registry.add_connection(conn)
+            self.credits[conn] = conn.cores * self.credits_per_core
+            self.dispatch_ready.notify()
+
+    def __handle_progress(self, connection: Connection, task_id: int, done: int, values: list[tuple[str, str]]):
+        with self.dispatch_ready:
+            task = self.registry.get(task_id, connection)
+            if task is None: return
+            task.progress = max(task.progress, done)
+        if values: self.__record_found(task.job_id, values)
+
+    def __update_rate(self, connection: Connection, core_rate: float):
+        # Each task runs on a single worker core, so hashes / latency is a per-core rate
+        previous = self.core_rates.get(connection)
+        self.core_rates[connection] = core_rate if previous is None else previous + RATE_SMOOTHING * (core_rate - previous)
+
+    def __update_cores(self, connection: Connection, cores: int):
+        # A relay's core count follows the workers attached to it
+        with self.dispatch_ready:
+            if connection not in self.credits: return
+            self.credits[connection] += (cores - connection.cores) * self.credits_per_core
+            connection.cores = cores
+            self.dispatch_ready.notify()
+        print(f"{connection.addr[0]} now has {cores} cores")
 
     def on_message(self, connection, raw, fields):
+        received = tracing.now()
         if not fields or len(fields) < 2:
             print(f"Invalid message from {connection}: {fields}")
             return
         
-        fields = connection._parse_fields(raw, 2)
+        fields = connection._parse_fields(raw, 1)
         msg_id = fields[0].decode()
-        task_id = fields[1].decode()
-        task = self.__finish_task(task_id)
-        rate = 0
+        decoder = MESSAGE_DECODERS.get(msg_id)
+        if decoder is None:
+            print(f"Unknown message {msg_id} from {connection.addr[0]}")
+            return
+        try:
+            message = decoder(fields[1])
+        except Exception as e:
+            print(f"Error decoding {msg_id} message from {connection.addr[0]}: {e}")
+            return
+
+        if msg_id == 'PROGRESS':
+            self.__handle_progress(connection, *message)
+        elif msg_id in ('FOUND', 'DONE'):
+            self.__handle_result(connection, msg_id, *message, received)
+        elif msg_id == 'ERROR':
+            self.__handle_error(connection, *message)
+        elif msg_id == 'BATCH':
+            results, progress = message
+            for task_id, done, values in progress:
+                self.__handle_progress(connection, task_id, done, values)
+            for task_id, values in results:
+                self.__handle_result(connection, 'FOUND' if values else 'DONE', task_id, values, received)
+        elif msg_id == 'CORES':
+            self.__update_cores(connection, message)
+        elif msg_id == 'FILES':
+            connection.files = set(message)
+            print(f"{connection.addr[0]} has {len(connection.files)} wordlists locally")
+        elif msg_id == 'TRACE':
+            tracing.add_remote(f"worker {connection.addr[0]}:{connection.addr[1]}", message)
+
+    def __handle_result(self, connection: Connection, msg_id: str, task_id: int, values: list[tuple[str, str]], received: int):
+        task = self.__finish_task(connection, task_id)
         time_took = time.time() - self.start_time
-        if task:
-            hashes_calculated = sum([self._len_of_expanded_task(t.input_buffer) for t in self.finished_tasks]) + self._len_of_expanded_task(task.input_buffer)
-            rate = (hashes_calculated // time_took) if time_took > 0 else 0
+        if not task:
+            # Late result for a task that was cancelled or reassigned in the meantime
+            if task_id not in self.registry.retired: print(f"{msg_id} for unknown task {task_id} from {connection.addr[0]}")
+            return
+        hashes = self._task_items(task)
+        latency = self.metrics.task_finished(task.id, f"{connection.addr[0]}:{connection.addr[1]}", hashes)
+        if msg_id == 'DONE' and latency > 0: self.__update_rate(connection, hashes / latency)
+        rate = int(self.metrics.average_rate())
 
         if msg_id == 'FOUND':
             
-            try:
-                values = pickle.loads(fields[2])
-                for value in values:
-                    print(f"Task {task_id} ({len(self.finished_tasks)}/{self.total_tasks}) marked as FOUND (value: {value}) by {connection.addr[0]} in {time_took:.2f}s, Rate: {rate} hashes/second")
-            except Exception as e:
-                print(f"Error processing FOUND message from {connection}: {e}")
+            for value, digest in values:
+                print(f"Task {task_id} ({self.finished_tasks}/{self.total_tasks}) marked as FOUND (value: {value}, digest: {digest}) by {connection.addr[0]} in {time_took:.2f}s, Rate: {rate} hashes/second")
+            self.__record_found(task.job_id, values)
         elif msg_id == 'DONE':
-            print(f"Task {task_id} ({len(self.finished_tasks)}/{self.total_tasks}) marked as DONE by {connection.addr[0]} (not found), Rate: {rate} hashes/second")
+            print(f"Task {task_id} ({self.finished_tasks}/{self.total_tasks}) marked as DONE by {connection.addr[0]} (not found), Rate: {rate} hashes/second")
+
+        # Journaled after any FOUND values, so a replay never sees a chunk done without its results
+        if task.job_id in self.journaled_jobs:
+            for start, end in task.input_buffer:
+                self.journal.record_done(task.job_id, start, end)
+        with self.dispatch_ready:
+            exhausted = self.__check_job(self.jobs[task.job_id])
+            self.dispatch_ready.notify()
+        if exhausted: self.__release_job(task.job_id)
+        tracing.record("result", received, task_id)
 
 if __name__ == "__main__":
-    to = TaskOrchestrator()
+    to = TaskOrchestrator(metrics_port=9100, journal_path="orchestrator.journal")
     to.start()
-    input("Press Enter to add tasks...\n\n")
-
-    core_count = len(to.cores)
-    max_num = 100_000_000
-    
-    chunk_size = max_num // core_count
-    range_strings = []
-    
-    for i in range(core_count):
-        start = i * chunk_size
-        if i == core_count - 1:
-            end = max_num
+    if to.active_jobs:
+        print("Resuming journaled jobs...\n")
+    else:
+        input("Press Enter to add tasks...\n\n")
+        if len(sys.argv) > 2 and sys.argv[1] == "--mask":
+            to.add_source(MaskChunker(
+                mask=Mask.parse(sys.argv[2], sys.argv[3:]),
+                action=Action.MD5,
+                expected_result="ef775988943825d2871e1cfa75473ec0"
+            ))
+            print("Added mask source to orchestrator...\n")
+        elif len(sys.argv) > 1:
+            to.add_source(WordlistChunker(
+                wordlist=Wordlist(sys.argv[1]),
+                action=Action.MD5,
+                expected_result="ef775988943825d2871e1cfa75473ec0"
+            ))
+            print("Added wordlist source to orchestrator...\n")
         else:
-            end = (i + 1) * chunk_size
-        range_strings.append(f"{start}-{end}")
-    
-    gen, chunk_count = Task.get_chunks(
-        data_gen=(range_str for range_str in range_strings), 
-        total_size=len(range_strings), 
-        chunk_count=core_count,
-        action=Action.MD5,
-        expected_result="ef775988943825d2871e1cfa75473ec0",
-        max_chunk_size=MAX_TASK_SIZE
-    )
-    print("Generated tasks, adding to orchestrator...\n")
-    to.add_tasks(gen, chunk_count)
+            to.add_source(AdaptiveChunker(
+                keyspace=range(100_000_000),
+                action=Action.MD5,
+                expected_result="ef775988943825d2871e1cfa75473ec0"
+            ))
+            print("Added adaptive keyspace source to orchestrator...\n")
     to.handle_tasks()
\ No newline at end of file
@@ -0,0 +1,131 @@
+import bisect
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)  # seconds
+
+class Histogram:
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def lines(self, name: str) -> list[str]:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum {self.sum}')
+        lines.append(f'{name}_count {self.count}')
+        return lines
+
+class Metrics:
+    def __init__(self, window: float = 10.0):
+        self.lock = threading.Lock()
+        self.window = window
+        self.start_time = time.time()
+
+        self.total_hashes = 0
+        self.tasks_finished = 0
+        self.connection_hashes: dict[str, int] = {}
+        self.recent: deque[tuple[float, int]] = deque()
+        self.recent_hashes = 0
+        self.task_latency = Histogram()
+        self.dispatched_at: dict[int, float] = {}
+        self.gauges: dict[str, callable] = {}
+
+    def __trim(self, now: float):
+        while self.recent and self.recent[0][0] < now - self.window:
+            self.recent_hashes -= self.recent.popleft()[1]
+
+    def task_dispatched(self, task_id: int):
+        with self.lock:
+            self.dispatched_at[task_id] = time.time()
+
+    def task_finished(self, task_id: int, connection: str, hashes: int) -> float:
+        now = time.time()
+        with self.lock:
+            self.total_hashes += hashes
+            self.tasks_finished += 1
+            self.connection_hashes[connection] = self.connection_hashes.get(connection, 0) + hashes
+            self.recent.append((now, hashes))
+            self.recent_hashes += hashes
+            self.__trim(now)
+
+            sent = self.dispatched_at.pop(task_id, None)
+            latency = now - sent if sent is not None else 0.0
+            if sent is not None: self.task_latency.observe(latency)
+        return latency
+
+    def task_dropped(self, task_id: int):
+        with self.lock:
+            self.dispatched_at.pop(task_id, None)
+
+    def rate(self) -> float:
+        with self.lock:
+            now = time.time()
+            self.__trim(now)
+            span = min(self.window, now - self.start_time)
+            return self.recent_hashes / span if span > 0 else 0.0
+
+    def average_rate(self) -> float:
+        elapsed = time.time() - self.start_time
+        return self.total_hashes / elapsed if elapsed > 0 else 0.0
+
+    def reset_clock(self):
+        with self.lock:
+            self.start_time = time.time()
+
+    def render(self) -> str:
+        rate = self.rate()
+        gauges = {name: gauge() for name, gauge in self.gauges.items()}
+        with self.lock:
+            lines = [
+                '# TYPE orchestrator_hashes_total counter',
+                f'orchestrator_hashes_total {self.total_hashes}',
+                '# TYPE orchestrator_tasks_finished_total counter',
+                f'orchestrator_tasks_finished_total {self.tasks_finished}',
+                '# TYPE orchestrator_hashes_per_second gauge',
+                f'orchestrator_hashes_per_second {rate:.1f}',
+                '# TYPE orchestrator_connection_hashes_total counter',
+            ]
+            lines.extend(f'orchestrator_connection_hashes_total{{connection="{conn}"}} {hashes}' for conn, hashes in self.connection_hashes.items())
+            lines.append('# TYPE orchestrator_task_latency_seconds histogram')
+            lines.extend(self.task_latency.lines('orchestrator_task_latency_seconds'))
+        for name, value in gauges.items():
+            lines.append(f'# TYPE orchestrator_{name} gauge')
+            lines.append(f'orchestrator_{name} {value}')
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, host: str = '127.0.0.1', port: int = 9100) -> ThreadingHTTPServer:
+        metrics = self
+
+        class _Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        httpd = ThreadingHTTPServer((host, port), _Handler)
+        threading.Thread(target=httpd.serve_forever, daemon=True).start()
+        print(f"Metrics available at http://{host}:{port}/metrics")
+        return httpd
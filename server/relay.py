@@ -0,0 +1,193 @@
+import argparse
+import os
+import sys
+import threading
+import time
+
+# The upstream side is a worker connection, so client/ provides SocketClient
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, 'common'))
+sys.path.append(os.path.join(ROOT, 'client'))
+
+import codec
+from main import AdaptiveChunker, Job, MaskChunker, Task, TaskOrchestrator
+from mask import Mask
+from socket_client import SocketClient
+
+RELAY_TARGET_SECONDS = 1.0  # sub-chunk duration on a downstream core, so each coordinator chunk spreads over several workers
+BATCH_INTERVAL = 0.25  # seconds between BATCH messages to the coordinator
+
+class RelayedTask:
+    def __init__(self, task_id: int, job_id: int, ranges: list[tuple[int, int]] = None):
+        self.task_id = task_id  # the coordinator's ids
+        self.job_id = job_id
+        self.ranges = ranges  # in the order the coordinator counts progress; None for word and slice inputs
+        self.done = 0  # items reported done upstream
+        self.reported: set[str] = set()  # digests already sent upstream
+
+    def searched(self, unsearched: list[tuple[int, int]]) -> int:
+        # Items done from the start of the task, i.e. the position of its first unsearched index
+        positions = []
+        for index, _ in unsearched:
+            offset = 0
+            for start, end in self.ranges:
+                if start <= index < end:
+                    positions.append(offset + index - start)
+                    break
+                offset += end - start
+        return min(positions, default=sum(end - start for start, end in self.ranges))
+
+class Relay:
+    def __init__(self, upstream_host: str, upstream_port: int, host: str = '0.0.0.0', port: int = 8081, min_workers: int = 1, metrics_port: int = None):
+        # Workers connect here as they would to the coordinator; the coordinator sees one worker with all their cores
+        self.upstream = SocketClient(upstream_host, upstream_port)
+        self.orchestrator = TaskOrchestrator(metrics_port=metrics_port)
+        self.orchestrator.server.host = host
+        self.orchestrator.server.port = port
+        self.min_workers = min_workers
+        self.cores = 0
+        self.lock = threading.Lock()
+        self.relayed: dict[int, RelayedTask] = {}  # by local job id; every coordinator task runs as one local job
+        self.targets: dict[int, set[str]] = {}  # coordinator job id -> its targets not found yet
+
+    def start(self):
+        self.orchestrator.start()
+        threading.Thread(target=self.orchestrator.handle_tasks, args=(False,), daemon=True).start()
+        print(f"Waiting for {self.min_workers} workers before connecting upstream...")
+        while len(self.orchestrator.credits) < self.min_workers:
+            time.sleep(0.1)
+        self.cores = self.orchestrator.core_count
+        self.upstream.connect()
+        self.upstream.handshake(self.cores)
+        threading.Thread(target=self.__report, daemon=True).start()
+
+    def __add_job(self, job_id: int, digest_size: int, digests: bytes):
+        with self.lock:
+            self.targets[job_id] = {digests[i:i + digest_size].hex() for i in range(0, len(digests), digest_size)}
+
+    def __accept(self, task_id: int, job_id: int, action: str, found: list[str], input_buffer: list):
+        with self.lock:
+            targets = self.targets.get(job_id)
+            if targets is not None:
+                targets.difference_update(found)
+                targets = list(targets)
+        if targets is None:
+            self.upstream.send_fields([
+                'ERROR',                                                        # ID
+                codec.encode_error(task_id, f"no targets for job {job_id}")     # Task ID + what went wrong
+            ])
+            return
+        if not targets:
+            # Every target was found after the coordinator sent this task
+            self.upstream.send_fields([
+                'DONE',                         # ID
+                codec.encode_done(task_id)      # Task ID
+            ])
+            return
+        if input_buffer and type(input_buffer[0]) is tuple and isinstance(input_buffer[0][0], Mask):
+            ranges = [(start, end) for _, start, end in input_buffer]
+            source = MaskChunker(input_buffer[0][0], action, targets, target_seconds=RELAY_TARGET_SECONDS, keyspace=ranges)
+        elif input_buffer and type(input_buffer[0]) is tuple:
+            ranges = list(input_buffer)
+            source = AdaptiveChunker(ranges, action, targets, target_seconds=RELAY_TARGET_SECONDS)
+        else:
+            # Words and wordlist slices go to one worker as they are
+            ranges = None
+        with self.lock:
+            job = self.orchestrator.add_source(source) if ranges else self.orchestrator.add_tasks(iter([Task(input_buffer, action, targets)]), 1)
+            self.relayed[job.id] = RelayedTask(task_id, job_id, ranges)
+
+    def cancel(self, data: bytes):
+        _, scope, target_id = self.upstream._parse_fields(data, 2)
+        target_id = int(target_id)
+        with self.lock:
+            jobs = [job_id for job_id, relayed in self.relayed.items() if (relayed.job_id if scope == b'JOB' else relayed.task_id) == target_id]
+            for job_id in jobs: del self.relayed[job_id]
+            # The coordinator also sends CANCEL JOB once a job is exhausted, so its targets go here
+            if scope == b'JOB': self.targets.pop(target_id, None)
+        for job_id in jobs:
+            self.orchestrator.cancel_job(job_id)
+            self.orchestrator.forget_job(job_id)
+
+    def __report(self):
+        # Everything that finished or moved on since the last tick goes up in one BATCH message
+        while True:
+            time.sleep(BATCH_INTERVAL)
+            cores = self.orchestrator.core_count
+            if cores != self.cores:
+                self.cores = cores
+                self.upstream.send_fields([
+                    'CORES',        # ID
+                    cores           # Cores of every attached worker
+                ])
+
+            results, progress, failed, finished = [], [], [], []
+            with self.lock:
+                for job_id, relayed in list(self.relayed.items()):
+                    status = self.orchestrator.job_status(job_id)
+                    values = [(value, digest) for digest, value in status["results"].items()]
+                    if status["state"] in (Job.EXHAUSTED, Job.FOUND):
+                        results.append((relayed.task_id, values))
+                        finished.append(job_id)
+                        continue
+                    new = [(value, digest) for value, digest in values if digest not in relayed.reported]
+                    if status["state"] == Job.FAILED:
+                        # Hits so far still go up; the coordinator requeues the rest from the last checkpoint
+                        if new: progress.append((relayed.task_id, relayed.done, new))
+                        failed.append(relayed.task_id)
+                        finished.append(job_id)
+                        continue
+                    done = relayed.searched(self.orchestrator.unsearched(job_id)) if relayed.ranges else 0
+                    if new or done > relayed.done:
+                        progress.append((relayed.task_id, done, new))
+                        relayed.reported.update(digest for _, digest in new)
+                        relayed.done = done
+                for job_id in finished:
+                    del self.relayed[job_id]
+            for job_id in finished:
+                self.orchestrator.forget_job(job_id)
+
+            if results or progress:
+                self.upstream.send_fields([
+                    'BATCH',                                    # ID
+                    codec.encode_batch(results, progress)       # Finished tasks + checkpoints of running ones
+                ])
+            for task_id in failed:
+                self.upstream.send_fields([
+                    'ERROR',                                                        # ID
+                    codec.encode_error(task_id, "failed on the relay's workers")    # Task ID + what went wrong
+                ])
+
+    def relay_tasks(self):
+        while True:
+            try:
+                data, fields = self.upstream.receive_fields(1)
+                if not fields:
+                    print("Connection closed by coordinator")
+                    break
+
+                if fields[0] == b'JOB':
+                    self.__add_job(*codec.decode_job(fields[1]))
+                elif fields[0] == b'TASK':
+                    self.__accept(*codec.decode_task(fields[1]))
+                elif fields[0] == b'CANCEL':
+                    self.cancel(data)
+            except KeyboardInterrupt:
+                print("Relay shutting down.")
+                break
+            except Exception as e:
+                print(f"Error receiving task: {e}")
+                break
+        self.orchestrator.server.stop()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="TaskOrchestrator relay: one coordinator connection for a group of workers")
+    parser.add_argument("upstream_host")
+    parser.add_argument("upstream_port", type=int)
+    parser.add_argument("--port", type=int, default=8081, help="port workers connect to")
+    parser.add_argument("--min-workers", type=int, default=1, help="workers to wait for before connecting upstream")
+    parser.add_argument("--metrics-port", type=int)
+    args = parser.parse_args()
+    relay = Relay(args.upstream_host, args.upstream_port, port=args.port, min_workers=args.min_workers, metrics_port=args.metrics_port)
+    relay.start()
+    relay.relay_tasks()
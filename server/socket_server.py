@@ -1,14 +1,19 @@
+import asyncio
 import socket
 import struct
 import threading
+import tracing
 
 from Crypto.PublicKey import ECC
 from Crypto.Protocol.KDF import HKDF
 from Crypto.Hash import SHA256
-from Crypto.Cipher import AES
+from cipher import CLIENT_TO_SERVER, SERVER_TO_CLIENT, SessionCipher
 
 SEPARATOR = b'\0'
 MSG_LEN_SIZE = 4  # bytes
+MAX_FRAME_SIZE = 256 * 1024 * 1024  # bytes; a longer length prefix drops the connection
+MAX_HANDSHAKE_FRAME_SIZE = 4096  # bytes, until the session key exists
+HANDSHAKE_TIMEOUT = 10  # seconds
 
 def derive_key(point):
     x = int(point.x)
@@ -21,7 +26,13 @@ class Connection:
         self.conn = conn
         self.addr = addr
         self.cores = 4
+        self.files: set[bytes] = set()  # ids of wordlists the worker has locally
+        self.jobs: dict[int, int] = {}  # job id -> found digests sent so far, for every job whose targets the worker holds
         self.aes_key = None
+        self.cipher: SessionCipher = None
+        self.recv_buffer = bytearray(1024)
+        # Held from encryption until the frame is handed to the socket, so frames go out in nonce order
+        self.send_lock = threading.RLock()
 
     def __encode_field(self, field: bytes) -> bytes:
         if isinstance(field, str): field = field.encode('utf-8')
@@ -30,57 +41,75 @@ class Connection:
         elif isinstance(field, bool): field = str(field).encode('utf-8')
         return field
 
-    def get_aes(self) -> AES:
-        return AES.new(self.aes_key, AES.MODE_EAX, nonce=b'0000000000000000') if self.aes_key else None
-
     def send_raw(self, data: bytes):
-        self.conn.sendall(data)
+        with self.send_lock:
+            self.conn.sendall(data)
 
-    def receive_raw(self, bufsize=1024) -> bytes:
-        data = b''
-        while len(data) < bufsize:
-            packet = self.conn.recv(bufsize - len(data))
-            if not packet:
+    def receive_raw(self, bufsize=1024) -> memoryview:
+        # Reads straight into a reusable buffer; the returned view is only valid until the next receive.
+        # The buffer doubles as bytes arrive instead of being sized from the peer's length prefix up front
+        received = 0
+        while received < bufsize:
+            if received == len(self.recv_buffer):
+                grown = bytearray(min(bufsize, 2 * len(self.recv_buffer)))
+                grown[:received] = self.recv_buffer
+                self.recv_buffer = grown
+            count = self.conn.recv_into(memoryview(self.recv_buffer)[received:bufsize])
+            if not count:
                 return b''
-            data += packet
-        return data
+            received += count
+        return memoryview(self.recv_buffer)[:bufsize]
 
     def _parse_fields(self, data: bytes, field_count: int = -1) -> list[bytes]:
         return data.split(SEPARATOR, field_count)
 
-    def send_fields(self, fields: list[bytes]):
+    def _encode_message(self, fields: list[bytes]) -> bytes:
         data = SEPARATOR.join([self.__encode_field(field) for field in fields])
-        if self.get_aes():
-            ciphertext = self.get_aes().encrypt(data)
-            data = b'AES' + SEPARATOR + ciphertext
-        data = len(data).to_bytes(MSG_LEN_SIZE, 'big') + data
-        self.send_raw(data)
+        if not self.cipher: return len(data).to_bytes(MSG_LEN_SIZE, 'big') + data
+        start = tracing.now()
+        frame = self.cipher.encrypt(data, MSG_LEN_SIZE)
+        tracing.record("encrypt", start)
+        frame[:MSG_LEN_SIZE] = (len(frame) - MSG_LEN_SIZE).to_bytes(MSG_LEN_SIZE, 'big')
+        return frame
+
+    def _decode_message(self, data: bytes, field_limit=-1) -> tuple[bytes, list[bytes]]:
+        if not data: return b'', []
+        # Once the session key exists every frame must authenticate; plaintext is never accepted
+        if self.cipher:
+            start = tracing.now()
+            data = self.cipher.decrypt(data)
+            tracing.record("decrypt", start)
+
+        data = bytes(data)
+        if not data: return b'', []
+        return data, self._parse_fields(data, field_limit)
+
+    def send_fields(self, fields: list[bytes]):
+        with self.send_lock:
+            self.send_raw(self._encode_message(fields))
+
+    def _frame_size(self, raw_msglen: bytes) -> int:
+        # The prefix is unauthenticated, so it is bounded before anything is read for it
+        msglen = int.from_bytes(raw_msglen, 'big')
+        limit = MAX_FRAME_SIZE if self.cipher else MAX_HANDSHAKE_FRAME_SIZE
+        if msglen > limit: raise Exception(f"Frame of {msglen} bytes exceeds the {limit} byte limit")
+        return msglen
 
     def receive_by_size(self) -> bytes:
         raw_msglen = self.receive_raw(MSG_LEN_SIZE)
         if not raw_msglen: return b''
-        msglen = int.from_bytes(raw_msglen, 'big')
-        return self.receive_raw(msglen)
+        return self.receive_raw(self._frame_size(raw_msglen))
 
     def receive_fields(self, field_limit=-1) -> tuple[bytes, list[bytes]]:
-        data = self.receive_by_size()
-        if not data: return b'', []
-        if self.aes_key and data.startswith(b'AES'):
-            fields = self._parse_fields(data, 1)
-            if len(fields) != 2 : raise Exception("Invalid AES message format")
-            if fields[0] != b'AES': raise Exception("Invalid AES message format")
-            ciphertext = fields[1]
-            data = self.get_aes().decrypt(ciphertext)
+        return self._decode_message(self.receive_by_size(), field_limit)
 
-        if not data: return b'', []
-        return data, self._parse_fields(data, field_limit)
-        
-    def connect(self):
+    def _start_handshake(self) -> ECC.EccKey:
         sk = ECC.generate(curve="P-256")
         server_pk = sk.public_key().export_key(format="DER")
         self.send_fields([b'HELLO', server_pk])
+        return sk
 
-        raw, fields = self.receive_fields(2)  
+    def _finish_handshake(self, sk: ECC.EccKey, raw: bytes):
         fields = (raw[0:5], raw[6:10], raw[11:])
         if fields[0] != b'HELLO': raise Exception("Invalid handshake from client")
         client_pk = ECC.import_key(fields[2])
@@ -92,37 +121,58 @@ class Connection:
             self.cores = 4
 
         shared = client_pk.pointQ * sk.d
-        key = derive_key(shared)
-        self.aes_key = key
-
-        d, _ = self.receive_fields(1)
-        if d != b'OK': raise Exception("AES handshake failed")
+        self.aes_key = derive_key(shared)
+        self.cipher = SessionCipher(self.aes_key, SERVER_TO_CLIENT, CLIENT_TO_SERVER)
 
+    def _confirm_handshake(self, data: bytes):
+        if data != b'OK': raise Exception("AES handshake failed")
         self.send_fields([b'OK'])
         print(f"AES session established with {f'{self.addr[0]}:{self.addr[1]}'}")
-        print("Shared key:", key.hex())
+        print("Shared key:", self.aes_key.hex())
         print(f"Client cores: {self.cores}")
         print()
 
+    def connect(self):
+        sk = self._start_handshake()
+        raw, _ = self.receive_fields(2)
+        self._finish_handshake(sk, raw)
+        d, _ = self.receive_fields(1)
+        self._confirm_handshake(d)
+
     def close(self):
         self.conn.close()
 
 class SocketServer:
-    def __init__(self, host='0.0.0.0', port=8080, listen=1000, callbacks: dict = {}, timeout: int = None):
+    def __init__(self, host='0.0.0.0', port=8080, listen=1000, callbacks: dict = {}, timeout: int = None, handshake_timeout: float = HANDSHAKE_TIMEOUT):
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         if timeout is not None:
             self.sock.settimeout(timeout)
         self.connections: list[Connection] = []
         self.callbacks = callbacks
+        self.handshake_timeout = handshake_timeout
+        self.stopped = False
 
         self.host = host
         self.port = port
         self.listen = listen
 
+    def __handshake(self, connection: Connection) -> bool:
+        try:
+            connection.conn.settimeout(self.handshake_timeout)
+            connection.connect()
+            connection.conn.settimeout(None)
+            return True
+        except Exception as e:
+            print(f"Handshake with {connection.addr} failed: {e}")
+            self.disconnect(connection)
+            return False
+
     def __handle_client(self, connection: Connection):
+        if not self.__handshake(connection): return
+        self.callbacks.get('on_connect', lambda conn: None)(connection)
         while True:
             try:
-                data, fields = connection.receive_fields()
+                data, fields = connection.receive_fields(1)
                 if not fields:
                     print(f"Connection closed by {connection.addr}")
                     self.disconnect(connection)
@@ -139,11 +189,14 @@ class SocketServer:
 
     def __connection_manager(self):
         while True:
-            conn, addr = self.sock.accept()
+            try:
+                conn, addr = self.sock.accept()
+            except OSError:
+                if self.stopped: break
+                raise
             connection = Connection(conn, addr)
             self.connections.append(connection)
             print(f"New connection from {f'{addr[0]}:{addr[1]}'}")
-            self.callbacks.get('on_connect', lambda conn: None)(connection)
             threading.Thread(target=self.__handle_client, args=(connection,), daemon=True).start()
 
     def start(self):
@@ -153,6 +206,7 @@ class SocketServer:
         threading.Thread(target=self.__connection_manager, daemon=True).start()
 
     def stop(self):
+        self.stopped = True
         self.sock.shutdown(socket.SHUT_RDWR)
         self.sock.close()
         print("Server stopped")
@@ -162,4 +216,109 @@ class SocketServer:
             if conn == connection:
                 conn.close()
                 self.connections.remove(connection)
-                print(f"Disconnected {connection.addr}")
\ No newline at end of file
+                print(f"Disconnected {connection.addr}")
+
+class AsyncConnection(Connection):
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter, loop: asyncio.AbstractEventLoop):
+        super().__init__(writer.get_extra_info('socket'), writer.get_extra_info('peername'))
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+
+    def send_raw(self, data: bytes):
+        # Safe from any thread; the write itself happens on the event loop and never blocks the caller
+        if self.writer.is_closing(): raise ConnectionError("Connection closed")
+        self.loop.call_soon_threadsafe(self.writer.write, data)
+
+    async def receive_by_size_async(self) -> bytes:
+        try:
+            raw_msglen = await self.reader.readexactly(MSG_LEN_SIZE)
+            return await self.reader.readexactly(self._frame_size(raw_msglen))
+        except asyncio.IncompleteReadError:
+            return b''
+
+    async def receive_fields_async(self, field_limit=-1) -> tuple[bytes, list[bytes]]:
+        return self._decode_message(await self.receive_by_size_async(), field_limit)
+
+    async def connect_async(self):
+        sk = self._start_handshake()
+        raw, _ = await self.receive_fields_async(2)
+        self._finish_handshake(sk, raw)
+        d, _ = await self.receive_fields_async(1)
+        self._confirm_handshake(d)
+
+    def close(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+class AsyncSocketServer(SocketServer):
+    def __init__(self, host='0.0.0.0', port=8080, listen=1000, callbacks: dict = {}, timeout: int = None, handshake_timeout: float = HANDSHAKE_TIMEOUT):
+        self.connections: list[Connection] = []
+        self.callbacks = callbacks
+        self.handshake_timeout = handshake_timeout
+
+        self.host = host
+        self.port = port
+        self.listen = listen
+        self.loop: asyncio.AbstractEventLoop = None
+        self.server: asyncio.Server = None
+        self.started = threading.Event()
+        self.error: Exception = None  # why the listener failed to start, raised again in start()
+
+    async def __handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            await self.__serve_client(reader, writer)
+        except asyncio.CancelledError:
+            pass  # the loop is shutting down after stop()
+
+    async def __serve_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        connection = AsyncConnection(reader, writer, self.loop)
+        self.connections.append(connection)
+        addr = connection.addr
+        print(f"New connection from {f'{addr[0]}:{addr[1]}'}")
+
+        try:
+            await asyncio.wait_for(connection.connect_async(), self.handshake_timeout)
+        except Exception as e:
+            print(f"Handshake with {addr} failed: {e!r}")
+            self.disconnect(connection)
+            return
+
+        self.callbacks.get('on_connect', lambda conn: None)(connection)
+        while True:
+            try:
+                data, fields = await connection.receive_fields_async(1)
+                if not fields:
+                    print(f"Connection closed by {connection.addr}")
+                    break
+
+                self.callbacks.get('on_message', lambda conn, raw, fields: None)(connection, data, fields)
+            except Exception as e:
+                print(f"Error with connection {connection.addr}: {e}")
+                break
+        self.disconnect(connection)
+        self.callbacks.get('on_disconnect', lambda conn: None)(connection)
+
+    async def __serve(self):
+        self.loop = asyncio.get_running_loop()
+        try:
+            self.server = await asyncio.start_server(self.__handle_client, self.host, self.port, backlog=self.listen)
+        except Exception as e:
+            self.error = e
+            self.started.set()
+            return
+        print(f"Server listening on {self.host}:{self.port} (asyncio)")
+        self.started.set()
+        try:
+            async with self.server:
+                await self.server.serve_forever()
+        except asyncio.CancelledError:
+            pass  # stop() closed the server
+
+    def start(self):
+        threading.Thread(target=asyncio.run, args=(self.__serve(),), daemon=True).start()
+        self.started.wait()
+        if self.error: raise self.error
+
+    def stop(self):
+        if self.server: self.loop.call_soon_threadsafe(self.server.close)
+        print("Server stopped")
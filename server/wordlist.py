@@ -0,0 +1,31 @@
+import mmap
+import os
+import zlib
+import codec
+
+COUNT_BLOCK = 64 * 1024 * 1024  # bytes scanned per step when counting lines
+SLICE_COMPRESSION = 1  # zlib level for slices sent to workers without the file
+
+class Wordlist:
+    def __init__(self, path: str):
+        self.path = os.path.abspath(path)
+        self.file = open(self.path, 'rb')
+        self.size = os.fstat(self.file.fileno()).st_size
+        # Mapped read-only, so the OS pages the file in on demand instead of copying it into the heap
+        self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.size else b''
+        self.id = codec.file_id(self.data)
+
+        self.line_count = sum(self.data[i:i + COUNT_BLOCK].count(b'\n') for i in range(0, self.size, COUNT_BLOCK))
+        if self.size and self.data[-1:] != b'\n': self.line_count += 1
+        self.line_bytes = self.size / self.line_count if self.line_count else 1
+        print(f"Mapped wordlist {self.path}: {self.line_count} lines, {self.size} bytes, id {self.id.hex()}")
+
+    def align(self, offset: int) -> int:
+        # Start of the first line at or after offset; chunk edges always land on one
+        if offset <= 0: return 0
+        if offset >= self.size: return self.size
+        newline = self.data.find(b'\n', offset - 1)
+        return self.size if newline < 0 else newline + 1
+
+    def slice(self, start: int, end: int) -> bytes:
+        return zlib.compress(self.data[start:end], SLICE_COMPRESSION)
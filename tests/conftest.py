@@ -0,0 +1,17 @@
+import os
+import socket
+import sys
+
+import pytest
+
+# The modules import each other by name, as when client/main.py or server/main.py is run directly
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'server'))
+sys.path.append(os.path.join(ROOT, 'common'))
+sys.path.append(os.path.join(ROOT, 'client'))
+
+@pytest.fixture
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
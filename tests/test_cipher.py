@@ -0,0 +1,73 @@
+import pytest
+
+import cipher
+from cipher import CLIENT_TO_SERVER, SERVER_TO_CLIENT, TAG_SIZE, SessionCipher
+
+KEY = bytes(range(32))
+
+def _session(backend: str) -> SessionCipher:
+    if backend == "cryptography" and not cipher.AESGCM: pytest.skip("cryptography is not installed")
+    session = SessionCipher(KEY, CLIENT_TO_SERVER, SERVER_TO_CLIENT)
+    if backend == "pycryptodome": session.aead = None
+    return session
+
+@pytest.fixture(params=["pycryptodome", "cryptography"])
+def backend(request) -> str:
+    return request.param
+
+def _receiver(backend: str) -> SessionCipher:
+    session = _session(backend)
+    session.send_direction, session.receive_direction = SERVER_TO_CLIENT, CLIENT_TO_SERVER
+    return session
+
+def test_frames_round_trip_after_the_header(backend):
+    sender, receiver = _session(backend), _receiver(backend)
+    for message in [b'', b'TASK', bytes(100_000)]:
+        frame = sender.encrypt(message, 4)
+        assert len(frame) == 4 + len(message) + TAG_SIZE
+        assert receiver.decrypt(memoryview(frame)[4:]) == message
+
+def test_altered_frame_is_rejected(backend):
+    sender, receiver = _session(backend), _receiver(backend)
+    frame = sender.encrypt(b'DONE 42')
+    for i in [0, len(frame) - 1]:
+        altered = bytearray(frame)
+        altered[i] ^= 1
+        with pytest.raises(Exception, match="Message authentication failed"):
+            receiver.decrypt(altered)
+    # A rejected frame does not advance the counter, so the untouched one still opens
+    assert receiver.decrypt(frame) == b'DONE 42'
+
+def test_replayed_frame_is_rejected(backend):
+    sender, receiver = _session(backend), _receiver(backend)
+    frame = sender.encrypt(b'FOUND 1')
+    assert receiver.decrypt(frame) == b'FOUND 1'
+    with pytest.raises(Exception, match="Message authentication failed"):
+        receiver.decrypt(frame)
+
+def test_reordered_frames_are_rejected(backend):
+    sender, receiver = _session(backend), _receiver(backend)
+    first, second = sender.encrypt(b'first'), sender.encrypt(b'second')
+    with pytest.raises(Exception, match="Message authentication failed"):
+        receiver.decrypt(second)
+    assert receiver.decrypt(first) == b'first'
+    assert receiver.decrypt(second) == b'second'
+
+def test_frame_from_the_other_direction_is_rejected(backend):
+    # The receiver's own outgoing frames carry its send direction, so reflecting one back fails
+    receiver = _receiver(backend)
+    with pytest.raises(Exception, match="Message authentication failed"):
+        receiver.decrypt(receiver.encrypt(b'CANCEL'))
+
+def test_short_frame_is_rejected(backend):
+    with pytest.raises(Exception, match="Encrypted message too short"):
+        _receiver(backend).decrypt(bytes(TAG_SIZE - 1))
+
+def test_backends_produce_the_same_frames():
+    fast, fallback = _session("cryptography"), _session("pycryptodome")
+    for message in [b'', b'TASK', bytes(range(256)) * 100]:
+        frame = fast.encrypt(message, 4)
+        assert frame == fallback.encrypt(message, 4)
+    # Either end may have either backend installed
+    assert _receiver("pycryptodome").decrypt(_session("cryptography").encrypt(b'JOB')) == b'JOB'
+    assert _receiver("cryptography").decrypt(_session("pycryptodome").encrypt(b'JOB')) == b'JOB'
@@ -0,0 +1,66 @@
+import threading
+
+import codec
+from journal import Journal
+from main import Action, AdaptiveChunker, TaskOrchestrator
+from test_orchestrator import StubConnection, md5, receive
+
+def test_subtract_handles_overlapping_and_unsorted_done_ranges():
+    ranges = [(500, 900), (0, 300)]
+    done = [(250, 600), (0, 100), (50, 120), (700, 710)]
+    assert Journal._subtract(ranges, done) == [(120, 250), (600, 700), (710, 900)]
+
+def test_replay_keeps_issued_but_unfinished_chunks_and_found_values(tmp_path):
+    path = str(tmp_path / "orchestrator.journal")
+    journal = Journal(path)
+    journal.record_job(1, "MD5", [md5("a"), md5("b")], [(0, 1000)])
+    journal.record_issued(1, 0, 500)
+    journal.record_done(1, 0, 200)
+    journal.record_found(1, md5("a"), "a")
+    journal.record_job(2, "MD5", [md5("c")], [(0, 10)])
+    journal.record_issued(2, 0, 10)
+    journal.record_done(2, 0, 10)
+    journal.record_completed(2)
+    journal.flush()
+
+    jobs, max_job_id = Journal(path).replay()
+    assert max_job_id == 2
+    (job,) = jobs
+    assert job["job_id"] == 1
+    assert job["targets"] == [md5("b")]
+    assert job["results"] == {md5("a"): "a"}
+    assert job["ranges"] == [(200, 1000)]
+
+def test_restarted_orchestrator_resumes_only_unfinished_work(tmp_path):
+    path = str(tmp_path / "orchestrator.journal")
+    orchestrator = TaskOrchestrator(transport="threaded", journal_path=path)
+    first, second = StubConnection(), StubConnection()
+    orchestrator.on_connect(first)
+    threading.Thread(target=orchestrator.handle_tasks, args=(False,), daemon=True).start()
+
+    # Completed after a disconnect: the first worker's checkpoint is kept, the second finishes the rest
+    finished = orchestrator.add_source(AdaptiveChunker(range(10_000), Action.MD5, md5("miss"), min_chunk_size=10_000, initial_chunk_size=10_000))
+    task_id = first.next_task()[0]
+    receive(orchestrator, first, 'PROGRESS', codec.encode_progress(task_id, 4_000, []))
+    orchestrator.on_disconnect(first)
+    orchestrator.on_connect(second)
+    retry_id, _, _, _, input_buffer = second.next_task()
+    assert input_buffer == [(4_000, 10_000)]
+    receive(orchestrator, second, 'DONE', codec.encode_done(retry_id))
+    assert orchestrator.job_status(finished.id)["state"] == "exhausted"
+
+    # Interrupted: one chunk done with a hit, the next still in flight when the server goes down
+    interrupted = orchestrator.add_source(AdaptiveChunker(range(30_000), Action.MD5, [md5("20"), md5("miss")], min_chunk_size=10_000, initial_chunk_size=10_000))
+    task_id, _, _, _, input_buffer = second.next_task()
+    receive(orchestrator, second, 'PROGRESS', codec.encode_progress(task_id, 5_000, [("20", md5("20"))]))
+    receive(orchestrator, second, 'DONE', codec.encode_done(task_id))
+    second.next_task()
+    orchestrator.journal.flush()
+
+    restarted = TaskOrchestrator(transport="threaded", journal_path=path)
+    restarted.resume()
+    assert list(restarted.jobs) == [interrupted.id]
+    status = restarted.job_status(interrupted.id)
+    assert status["results"] == {md5("20"): "20"}
+    assert status["targets"] == 1
+    assert restarted.unsearched(interrupted.id) == [(input_buffer[0][1], 30_000)]
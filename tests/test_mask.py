@@ -0,0 +1,66 @@
+import itertools
+
+import pytest
+
+import codec
+import mask
+from mask import Mask
+
+def _masks() -> list[Mask]:
+    return [
+        Mask.parse('?d?d?d'),
+        Mask.parse('?1?d?2', ['ab', '?u?s']),                   # custom charsets of different sizes
+        Mask.parse('x?1?d?1', ['?h??'], min_length=1),          # mixed lengths 1 to 4 and a literal
+        Mask.parse('?l?d?1?d', ['\xe9\xff'], min_length=2),     # non-ASCII bytes
+    ]
+
+def _flatten(m: Mask, start: int, end: int) -> list[bytes]:
+    return [prefix + suffix for prefix, suffixes in m.blocks(start, end) for suffix in suffixes]
+
+def _bounds(m: Mask) -> list[int]:
+    # Every length boundary and a few points around it, plus the ends of the keyspace
+    points = {0, 1, m.size - 1, m.size}
+    for _, first, count in m.lengths:
+        points |= {first - 1, first, first + 1, first + count // 2, first + count - 1}
+    return sorted(p for p in points if 0 <= p <= m.size)
+
+@pytest.fixture(params=[mask.SUFFIX_LIMIT, 16, 1])
+def suffix_limit(request, monkeypatch):
+    # Small tables split the same masks into many blocks, so ranges start and end inside them
+    monkeypatch.setattr(mask, "SUFFIX_LIMIT", request.param)
+    return request.param
+
+@pytest.mark.parametrize("m", _masks(), ids=lambda m: f"{len(m.charsets)}-{m.min_length}")
+def test_blocks_match_candidate(m, suffix_limit):
+    m = Mask(m.charsets, m.min_length)
+    expected = [m.candidate(i) for i in range(m.size)]
+    assert len(set(expected)) == m.size
+    for start, end in itertools.combinations(_bounds(m), 2):
+        assert _flatten(m, start, end) == expected[start:end]
+    assert _flatten(m, 5, 5) == []
+
+def test_candidates_are_shortest_first_with_the_last_position_fastest():
+    m = Mask.parse('?1?2', ['ab', 'xyz'], min_length=1)
+    assert [m.candidate(i) for i in range(m.size)] == [b'a', b'b', b'ax', b'ay', b'az', b'bx', b'by', b'bz']
+    with pytest.raises(Exception, match="outside a keyspace"):
+        m.candidate(m.size)
+
+@pytest.mark.parametrize("m", _masks(), ids=lambda m: f"{len(m.charsets)}-{m.min_length}")
+def test_spec_round_trip(m):
+    copy = Mask.from_spec(m.to_spec())
+    assert (copy.charsets, copy.min_length, copy.size, copy.lengths) == (m.charsets, m.min_length, m.size, m.lengths)
+
+    # The mask travels once per task, ahead of its index ranges
+    payload = codec.encode_task(3, 1, "MD5", [], [(m, 0, 10), (m, 20, m.size)])
+    _, _, _, _, input_buffer = codec.decode_task(payload)
+    assert [(start, end) for _, start, end in input_buffer] == [(0, 10), (20, m.size)]
+    assert all(item[0] is input_buffer[0][0] for item in input_buffer)
+    assert _flatten(input_buffer[0][0], 0, m.size) == _flatten(m, 0, m.size)
+
+def test_invalid_masks_are_rejected():
+    with pytest.raises(Exception, match="Unknown charset"):
+        Mask.parse('?x')
+    with pytest.raises(Exception, match="not a single byte"):
+        Mask.parse('€')
+    with pytest.raises(Exception, match="outside"):
+        Mask.parse('?d?d', min_length=3)
@@ -0,0 +1,288 @@
+import contextlib
+import hashlib
+import itertools
+import os
+import queue
+import random
+import signal
+import subprocess
+import sys
+import threading
+import time
+import zlib
+
+import pytest
+
+import codec
+from main import MAX_TASK_FAILURES, Action, AdaptiveChunker, Job, Task, TaskOrchestrator, WordlistChunker
+from socket_server import SEPARATOR
+from wordlist import Wordlist
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+class StubConnection:
+    # Stands in for a worker connection: records what the orchestrator sends instead of writing it
+    ports = itertools.count(40000)
+
+    def __init__(self, cores: int = 1):
+        self.addr = ('127.0.0.1', next(StubConnection.ports))
+        self.cores = cores
+        self.files: set[bytes] = set()
+        self.jobs: dict[int, int] = {}
+        self.sent: queue.Queue = queue.Queue()
+
+    def send_fields(self, fields: list):
+        self.sent.put(fields)
+
+    def _parse_fields(self, data: bytes, field_count: int = -1) -> list[bytes]:
+        return data.split(SEPARATOR, field_count)
+
+    def next_task(self, timeout: float = 5) -> tuple:
+        while True:
+            fields = self.sent.get(timeout=timeout)
+            if fields[0] == 'TASK': return codec.decode_task(fields[1])
+
+def receive(orchestrator: TaskOrchestrator, conn: StubConnection, msg_id: str, payload: bytes):
+    raw = msg_id.encode() + SEPARATOR + payload
+    orchestrator.on_message(conn, raw, raw.split(SEPARATOR, 1))
+
+def md5(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+def dispatching(orchestrator: TaskOrchestrator) -> threading.Thread:
+    thread = threading.Thread(target=orchestrator.handle_tasks, daemon=True)
+    thread.start()
+    return thread
+
+def test_queue_depth_counts_adaptive_chunks():
+    orchestrator = TaskOrchestrator(transport="threaded")
+    queue_depth = orchestrator.metrics.gauges["queue_depth"]
+    conn = StubConnection(cores=2)
+    orchestrator.on_connect(conn)
+    orchestrator.add_source(AdaptiveChunker(range(50_000), Action.MD5, md5("miss"), min_chunk_size=10_000, initial_chunk_size=10_000))
+    dispatcher = dispatching(orchestrator)
+
+    for _ in range(5):
+        task_id = conn.next_task()[0]
+        assert queue_depth() >= 0
+        receive(orchestrator, conn, 'DONE', codec.encode_done(task_id))
+    dispatcher.join(timeout=5)
+
+    assert not dispatcher.is_alive()
+    assert orchestrator.total_tasks == orchestrator.finished_tasks == 5
+    assert queue_depth() == 0
+
+def test_targets_are_sent_once_and_later_tasks_carry_new_hits():
+    orchestrator = TaskOrchestrator(transport="threaded")
+    conn = StubConnection()
+    orchestrator.on_connect(conn)
+    targets = [md5("1234"), md5("miss")]
+    job = orchestrator.add_source(AdaptiveChunker(range(30_000), Action.MD5, targets, min_chunk_size=10_000, initial_chunk_size=10_000))
+    dispatcher = dispatching(orchestrator)
+
+    msg_id, payload = conn.sent.get(timeout=5)
+    job_id, digest_size, digests = codec.decode_job(payload)
+    assert (msg_id, job_id) == ('JOB', job.id)
+    assert {digests[i:i + digest_size].hex() for i in range(0, len(digests), digest_size)} == set(targets)
+
+    found = []
+    for _ in range(3):
+        msg_id, payload = conn.sent.get(timeout=5)
+        assert msg_id == 'TASK'
+        task_id, _, _, task_found, _ = codec.decode_task(payload)
+        found.append(task_found)
+        if task_id == 1: receive(orchestrator, conn, 'PROGRESS', codec.encode_progress(task_id, 5_000, [("1234", md5("1234"))]))
+        receive(orchestrator, conn, 'DONE', codec.encode_done(task_id))
+    dispatcher.join(timeout=5)
+
+    assert found == [[], [md5("1234")], []]
+    # Exhausted with a target left: the worker is told, so it can free the job's targets
+    assert conn.sent.get(timeout=5) == ['CANCEL', 'JOB', str(job.id)]
+    assert not conn.jobs
+
+def test_cancelled_task_requeues_its_unsearched_remainder():
+    orchestrator = TaskOrchestrator(transport="threaded")
+    conn = StubConnection()
+    orchestrator.on_connect(conn)
+    job = orchestrator.add_source(AdaptiveChunker(range(20_000), Action.MD5, md5("15000"), min_chunk_size=20_000, initial_chunk_size=20_000))
+    dispatcher = dispatching(orchestrator)
+
+    task_id = conn.next_task()[0]
+    receive(orchestrator, conn, 'PROGRESS', codec.encode_progress(task_id, 5_000, []))
+    orchestrator.cancel_task(task_id)
+    retry_id, _, _, _, input_buffer = conn.next_task()
+    assert input_buffer == [(5_000, 20_000)]
+    assert orchestrator.job_status(job.id)["state"] == Job.RUNNING
+
+    receive(orchestrator, conn, 'FOUND', codec.encode_found(retry_id, [("15000", md5("15000"))]))
+    dispatcher.join(timeout=5)
+    status = orchestrator.job_status(job.id)
+    assert status["state"] == Job.FOUND
+    assert status["items_done"] == 20_000
+
+def test_job_without_targets_is_rejected():
+    orchestrator = TaskOrchestrator(transport="threaded")
+    with pytest.raises(Exception, match="no targets"):
+        orchestrator.add_source(AdaptiveChunker(range(1000), Action.MD5, []))
+    with pytest.raises(Exception, match="no targets"):
+        orchestrator.add_tasks(*Task.get_chunks(range(1000), 1000, 2, Action.MD5, []))
+    assert not orchestrator.jobs
+
+def test_cancelled_job_leaves_no_queued_tasks():
+    orchestrator = TaskOrchestrator(transport="threaded")
+    tasks, count = Task.get_chunks(range(1000), 1000, 10, Action.MD5, md5("miss"))
+    job = orchestrator.add_tasks(tasks, count)
+    assert orchestrator.metrics.gauges["queue_depth"]() == 10
+
+    orchestrator.cancel_job(job.id)
+    assert orchestrator.metrics.gauges["queue_depth"]() == 0
+
+def test_wordlist_job_reports_items_in_one_unit(tmp_path):
+    path = tmp_path / "words.txt"
+    path.write_bytes(b''.join(b'word%d\n' % i for i in range(20_000)))
+    orchestrator = TaskOrchestrator(transport="threaded")
+    conn = StubConnection()
+    orchestrator.on_connect(conn)
+    job = orchestrator.add_source(WordlistChunker(Wordlist(str(path)), Action.MD5, md5("miss"), min_chunk_size=5_000, initial_chunk_size=5_000))
+    dispatcher = dispatching(orchestrator)
+
+    deadline = time.monotonic() + 10
+    while dispatcher.is_alive() and time.monotonic() < deadline:
+        try:
+            task_id = conn.next_task(timeout=0.5)[0]
+        except queue.Empty:
+            continue
+        receive(orchestrator, conn, 'DONE', codec.encode_done(task_id))
+
+    status = orchestrator.job_status(job.id)
+    assert status["state"] == "exhausted"
+    assert status["items_done"] == status["items_total"] == path.stat().st_size
+
+def test_error_requeues_the_unfinished_remainder():
+    orchestrator = TaskOrchestrator(transport="threaded")
+    conn = StubConnection()
+    orchestrator.on_connect(conn)
+    job = orchestrator.add_source(AdaptiveChunker(range(20_000), Action.MD5, md5("miss"), min_chunk_size=20_000, initial_chunk_size=20_000))
+    dispatcher = dispatching(orchestrator)
+
+    task_id = conn.next_task()[0]
+    receive(orchestrator, conn, 'PROGRESS', codec.encode_progress(task_id, 5_000, []))
+    receive(orchestrator, conn, 'ERROR', codec.encode_error(task_id, "worker failed"))
+    retry_id, _, _, _, input_buffer = conn.next_task()
+    assert input_buffer == [(5_000, 20_000)]
+    receive(orchestrator, conn, 'DONE', codec.encode_done(retry_id))
+    dispatcher.join(timeout=5)
+
+    assert orchestrator.job_status(job.id)["state"] == Job.EXHAUSTED
+    assert orchestrator.credits[conn] == conn.cores
+
+def test_repeated_errors_fail_the_job():
+    orchestrator = TaskOrchestrator(transport="threaded")
+    conn = StubConnection()
+    orchestrator.on_connect(conn)
+    job = orchestrator.add_source(AdaptiveChunker(range(20_000), Action.MD5, md5("miss"), min_chunk_size=20_000, initial_chunk_size=20_000))
+    dispatcher = dispatching(orchestrator)
+
+    for _ in range(MAX_TASK_FAILURES):
+        task_id = conn.next_task()[0]
+        receive(orchestrator, conn, 'ERROR', codec.encode_error(task_id, "worker failed"))
+    dispatcher.join(timeout=5)
+
+    assert not dispatcher.is_alive()
+    assert orchestrator.job_status(job.id)["state"] == Job.FAILED
+    assert orchestrator.metrics.gauges["queue_depth"]() == 0
+    assert orchestrator.credits[conn] == conn.cores
+
+def test_disconnect_requeues_only_the_remainder_and_keeps_hits():
+    orchestrator = TaskOrchestrator(transport="threaded")
+    first, second = StubConnection(), StubConnection()
+    orchestrator.on_connect(first)
+    job = orchestrator.add_source(AdaptiveChunker(range(20_000), Action.MD5, [md5("1234"), md5("19999")], min_chunk_size=20_000, initial_chunk_size=20_000))
+    dispatcher = dispatching(orchestrator)
+
+    task_id = first.next_task()[0]
+    receive(orchestrator, first, 'PROGRESS', codec.encode_progress(task_id, 8_000, [("1234", md5("1234"))]))
+    orchestrator.on_disconnect(first)
+    orchestrator.on_connect(second)
+    retry_id, _, _, _, input_buffer = second.next_task()
+    assert input_buffer == [(8_000, 20_000)]
+    assert orchestrator.job_status(job.id)["results"] == {md5("1234"): "1234"}
+
+    receive(orchestrator, second, 'FOUND', codec.encode_found(retry_id, [("19999", md5("19999"))]))
+    dispatcher.join(timeout=5)
+    status = orchestrator.job_status(job.id)
+    assert status["state"] == Job.FOUND
+    assert status["results"] == {md5("1234"): "1234", md5("19999"): "19999"}
+
+def test_disconnect_requeues_the_unsearched_part_of_a_wordlist_slice():
+    # A relay passes a coordinator's slice on as it is; its workers count progress in decompressed bytes
+    orchestrator = TaskOrchestrator(transport="threaded")
+    first, second = StubConnection(), StubConnection()
+    orchestrator.on_connect(first)
+    data = b''.join(f"{i:09}\n".encode() for i in range(500))
+    job = orchestrator.add_tasks(iter([Task([zlib.compress(data)], Action.MD5, [md5("000000450")])]), 1)
+    dispatcher = dispatching(orchestrator)
+
+    task_id = first.next_task()[0]
+    receive(orchestrator, first, 'PROGRESS', codec.encode_progress(task_id, 1_000, []))
+    orchestrator.on_disconnect(first)
+    assert orchestrator.job_status(job.id)["state"] != Job.EXHAUSTED
+    orchestrator.on_connect(second)
+    retry_id, _, _, _, input_buffer = second.next_task()
+    assert [zlib.decompress(item) for item in input_buffer] == [data[1_000:]]
+
+    receive(orchestrator, second, 'FOUND', codec.encode_found(retry_id, [("000000450", md5("000000450"))]))
+    dispatcher.join(timeout=5)
+    assert orchestrator.job_status(job.id)["state"] == Job.FOUND
+
+def _spawn_worker(port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, 'main.py', '127.0.0.1', str(port), '1'],
+        cwd=os.path.join(ROOT, 'client'),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+        start_new_session=True,  # so killpg takes its pool process too
+    )
+
+def _wait_for(condition, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline: raise TimeoutError("condition not met in time")
+        time.sleep(0.02)
+
+def test_sigkilled_worker_loses_only_its_unfinished_remainder():
+    orchestrator = TaskOrchestrator()
+    orchestrator.server.host = '127.0.0.1'
+    orchestrator.server.port = random.randint(20000, 60000)
+    orchestrator.start()
+    sent = []
+    send_task = orchestrator._TaskOrchestrator__send_task
+    def recording_send(connection, task):
+        sent.append((connection, task))
+        send_task(connection, task)
+    orchestrator._TaskOrchestrator__send_task = recording_send
+
+    workers = [_spawn_worker(orchestrator.server.port)]
+    try:
+        _wait_for(lambda: orchestrator.credits)
+        # One chunk far longer than a PROGRESS interval, with a hit near its start
+        keyspace = 50_000_000
+        job = orchestrator.add_source(AdaptiveChunker(range(keyspace), Action.MD5, [md5("1000"), md5("miss")], min_chunk_size=keyspace, initial_chunk_size=keyspace))
+        threading.Thread(target=orchestrator.handle_tasks, daemon=True).start()
+        _wait_for(lambda: sent and sent[0][1].progress > 0)
+        os.killpg(workers[0].pid, signal.SIGKILL)
+        _wait_for(lambda: not orchestrator.credits)
+
+        workers.append(_spawn_worker(orchestrator.server.port))
+        _wait_for(lambda: len(sent) == 2)
+        killed, retry = sent[0][1], sent[1][1]
+        assert 1000 < killed.progress < keyspace
+        assert retry.input_buffer == [(killed.progress, keyspace)]
+        assert orchestrator.job_status(job.id)["results"] == {md5("1000"): "1000"}
+        orchestrator.cancel_job(job.id)
+    finally:
+        for worker in workers:
+            with contextlib.suppress(ProcessLookupError):
+                os.killpg(worker.pid, signal.SIGKILL)
+            worker.wait()
+        orchestrator.server.stop()
@@ -0,0 +1,71 @@
+import os
+import socket
+import threading
+
+import pytest
+
+from cipher import CLIENT_TO_SERVER, SERVER_TO_CLIENT, SessionCipher
+from socket_client import SocketClient
+from socket_server import MAX_FRAME_SIZE, MSG_LEN_SIZE, AsyncSocketServer, Connection, SocketServer
+
+def _closed_by_peer(sock: socket.socket) -> bool:
+    # Unread bytes on the server's side turn its close into a reset
+    try:
+        return sock.recv(1) == b''
+    except ConnectionResetError:
+        return True
+
+def _receiver(kind: str, sock: socket.socket):
+    if kind == "server": return Connection(sock, ('127.0.0.1', 0))
+    client = SocketClient('127.0.0.1', 0)
+    client.sock.close()
+    client.sock = sock
+    return client
+
+@pytest.fixture(params=["server", "client"])
+def pair(request):
+    local, peer = socket.socketpair()
+    yield _receiver(request.param, local), peer
+    local.close()
+    peer.close()
+
+def test_buffer_grows_only_with_received_bytes(pair):
+    receiver, peer = pair
+    peer.sendall(os.urandom(10_000))
+    peer.shutdown(socket.SHUT_WR)
+    assert receiver.receive_raw(200 * 1024 * 1024) == b''
+    assert len(receiver.recv_buffer) <= 16 * 1024
+
+def test_large_frame_is_reassembled(pair):
+    receiver, peer = pair
+    data = os.urandom(3 * 1024 * 1024 + 7)
+    threading.Thread(target=peer.sendall, args=(data,), daemon=True).start()
+    assert bytes(receiver.receive_raw(len(data))) == data
+
+def test_oversized_prefix_before_handshake_is_rejected(pair):
+    receiver, peer = pair
+    peer.sendall((1 << 30).to_bytes(MSG_LEN_SIZE, 'big') + b'x')
+    with pytest.raises(Exception, match="exceeds"):
+        receiver.receive_by_size()
+    assert len(receiver.recv_buffer) <= 1024
+
+def test_oversized_prefix_after_handshake_is_rejected(pair):
+    receiver, peer = pair
+    receiver.cipher = SessionCipher(bytes(32), SERVER_TO_CLIENT, CLIENT_TO_SERVER)
+    peer.sendall((MAX_FRAME_SIZE + 1).to_bytes(MSG_LEN_SIZE, 'big') + b'x')
+    with pytest.raises(Exception, match="exceeds"):
+        receiver.receive_by_size()
+    assert len(receiver.recv_buffer) <= 1024
+
+@pytest.mark.parametrize("server_class", [SocketServer, AsyncSocketServer])
+def test_server_drops_unauthenticated_oversized_frame(server_class, free_port):
+    server = server_class(host='127.0.0.1', port=free_port)
+    server.start()
+    try:
+        with socket.create_connection((server.host, server.port), timeout=5) as sock:
+            hello_size = int.from_bytes(sock.recv(MSG_LEN_SIZE), 'big')
+            while hello_size: hello_size -= len(sock.recv(hello_size))
+            sock.sendall((1 << 30).to_bytes(MSG_LEN_SIZE, 'big') + b'x')
+            assert _closed_by_peer(sock)
+    finally:
+        server.stop()
@@ -0,0 +1,26 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from socket_server import AsyncSocketServer, SocketServer
+
+@pytest.mark.parametrize("server_class", [SocketServer, AsyncSocketServer])
+def test_start_raises_when_port_is_taken(server_class):
+    with socket.socket() as taken:
+        taken.bind(('127.0.0.1', 0))
+        taken.listen()
+        server = server_class(host='127.0.0.1', port=taken.getsockname()[1])
+        with pytest.raises(OSError):
+            server.start()
+
+@pytest.mark.parametrize("server_class", [SocketServer, AsyncSocketServer])
+def test_stop_ends_serving_without_errors(server_class, free_port, monkeypatch):
+    errors = []
+    monkeypatch.setattr(threading, "excepthook", errors.append)
+    server = server_class(host='127.0.0.1', port=free_port)
+    server.start()
+    server.stop()
+    time.sleep(0.2)
+    assert not errors
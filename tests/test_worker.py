@@ -0,0 +1,110 @@
+import hashlib
+import importlib.util
+import multiprocessing
+import os
+import queue
+import zlib
+
+import pytest
+
+import codec
+from task import HASH_FUNCS, DigestIndex, Task, TaskHandler
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# client/main.py shares its module name with server/main.py, so it is loaded under its own
+spec = importlib.util.spec_from_file_location("worker_main", os.path.join(ROOT, 'client', 'main.py'))
+worker_main = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(worker_main)
+
+class StubClient:
+    def __init__(self):
+        self.sent: list[list] = []
+
+    def send_fields(self, fields: list):
+        self.sent.append(fields)
+
+def _worker() -> "worker_main.Worker":
+    worker = worker_main.Worker('127.0.0.1', 0, 1)
+    worker.client = StubClient()
+    return worker
+
+def test_failed_task_is_reported_as_error():
+    worker = _worker()
+    worker.task_finished(7, "error", ["Unsupported action SHA1"])
+    (fields,) = worker.client.sent
+    assert fields[0] == 'ERROR'
+    assert codec.decode_error(fields[1]) == (7, "Unsupported action SHA1")
+
+def test_cancelled_task_is_not_reported():
+    worker = _worker()
+    worker.task_finished(7, "cancelled", [])
+    assert not worker.client.sent
+
+def _md5(value: str) -> bytes:
+    return hashlib.md5(value.encode()).digest()
+
+@pytest.fixture(params=["set", "compact"])
+def index(request, monkeypatch):
+    # The same job index as a pool process caches it, in both of its layouts
+    if request.param == "compact": monkeypatch.setattr("task.SET_TARGET_LIMIT", 1)
+    return DigestIndex([_md5("5"), _md5("miss")])
+
+def _run(index: DigestIndex, task_id: int, input_buffer: list, cancelled: callable = None) -> tuple:
+    results = []
+    TaskHandler.cpu_compute_task(0, Task("MD5", task_id, None, input_buffer, 1), lambda *result: results.append(result), cancelled, index=index)
+    return results[0]
+
+def test_cached_index_skips_hits_of_earlier_tasks(index):
+    assert _run(index, 1, [(0, 100)]) == (1, "found", [("5", _md5("5").hex())])
+    assert _run(index, 2, [(0, 100)]) == (2, "done", [])
+    assert index.remaining == 1
+
+def test_cancelled_task_leaves_its_hits_to_the_retry(index):
+    # The head of a range is hashed before the first cancellation check
+    assert _run(index, 1, [(0, 5_000)], cancelled=lambda: True) == (1, "cancelled", [])
+    assert _run(index, 2, [(0, 100)]) == (2, "found", [("5", _md5("5").hex())])
+
+def test_targets_found_elsewhere_are_dropped(index):
+    index.drop(_md5("5"))
+    index.drop(_md5("not a target"))
+    index.drop(_md5("5"))
+    assert index.remaining == 1
+    assert _run(index, 1, [(0, 100)]) == (1, "done", [])
+
+def test_cancel_written_before_the_task_is_taken_still_stops_it(monkeypatch):
+    # e.g. the task reached the head of its core while the pool process was still unpickling it
+    monkeypatch.setattr(TaskHandler, "_pin", staticmethod(lambda cpu: None))
+    tasks, results = queue.Queue(), queue.Queue()
+    tasks.put(Task("MD5", 7, _md5("miss").hex(), [(0, 100_000_000)]))
+    tasks.put(None)
+    TaskHandler._pool_worker(0, 0, tasks, results, multiprocessing.Value('Q', 7))
+    assert results.get_nowait() == (0, 7, "cancelled", [])
+
+def test_range_stops_hashing_once_every_target_is_found(monkeypatch):
+    hashed = []
+    def md5(data: bytes):
+        hashed.append(data)
+        return hashlib.md5(data)
+    monkeypatch.setitem(HASH_FUNCS, "MD5", md5)
+    index = DigestIndex([_md5("5000")])
+    assert _run(index, 1, [(0, 50_000_000)]) == (1, "found", [("5000", _md5("5000").hex())])
+    assert len(hashed) <= 6_000
+
+def test_targets_that_fail_to_load_turn_the_jobs_tasks_into_errors(monkeypatch):
+    monkeypatch.setattr(TaskHandler, "_pin", staticmethod(lambda cpu: None))
+    tasks, results = queue.Queue(), queue.Queue()
+    tasks.put(("targets", 1, 16, None))
+    tasks.put(Task("MD5", 7, None, [(0, 100)], 1))
+    tasks.put(None)
+    TaskHandler._pool_worker(0, 0, tasks, results, multiprocessing.Value('Q', 0))
+    assert results.get_nowait() == (0, 7, "error", ["No targets for job 1"])
+
+def test_empty_target_list_unpacks_to_an_empty_index():
+    assert DigestIndex.unpack(b'', 0).remaining == 0
+
+def test_wordlist_hits_keep_their_exact_bytes():
+    words = [b'plain', 'caf\u00e9'.encode(), b'caf\xe9']
+    index = DigestIndex([hashlib.md5(word).digest() for word in words])
+    _, status, values = _run(index, 1, [zlib.compress(b'\n'.join(words) + b'\n')])
+    assert status == "found"
+    assert sorted(value for value, _ in values) == ['$HEX[636166e9]', 'caf\u00e9', 'plain']